@@ -9,177 +9,223 @@ To use this script to process data files call:
     python3 MCB_TM.py file_name1 file_name2 ...
 
 The resulting CSVs will be placed in the directory Processed_Data/
+
+Add --npz to also write each profile as typed NumPy columns (.npz), including the
+smoothed reel kinematics (see st2tm/kinematics.py, --window sets the smoothing)
 """
 
 import csv 
-import xml.etree.ElementTree as ET 
 import struct
 import time
 from datetime import datetime
 import sys
 import os
+import io
+import argparse
+import numpy as np
+import st2tm
 
 # Results directory
 RESULTS_DIR = 'Processed_Data'
 
-# ADC -> Current conversion constants
-SENSE_CURR_SLOPE = 11700
-MAX_ADC_READ = 4095
-VREF = 3.196
-I_OFFSET = 0.00018
-PULLDOWN_RESISTOR = 2000
-SUPPLY_VOLT_DIV = 0.102
-
-def readTMfile(TMfile,base_directory,lines):
-    with open(base_directory + '/' + TMfile, 'rb') as TM_file:
-        header = [next(TM_file).decode() for x in range(lines)]
-        TM_file.readline()
-        data = TM_file.readlines()
+# ADC -> Current conversion constants, MCB packet layout and decoding (see st2tm/mcb.py)
+from st2tm.mcb import (SENSE_CURR_SLOPE, MAX_ADC_READ, VREF, I_OFFSET, PULLDOWN_RESISTOR, SUPPLY_VOLT_DIV,
+                       MCB_PACKET_DTYPE, ROTATING_CHANNELS, mcbColumns)
+from st2tm.header import parseXML
+from st2tm.kinematics import SMOOTHING_WINDOW, KINEMATICS_COLUMNS
 
-    return ''.join(header), b''.join(data)
+CSV_HEADER = st2tm.mcb.MCB_COLUMNS
 
-def readDataFile(TMfile, base_directory):
-    with open(base_directory + '/' + TMfile, 'rb') as TM_file:
-        data = TM_file.readlines()
+def readTMheader(TMfile,base_directory,lines):
+    # read only as much of the file as the XML header needs, returns the header and the payload offset
+    return st2tm.readHeader(base_directory + '/' + TMfile, lines)
 
-    return b''.join(data)
+def readTMpayload(TMfile,base_directory,data_start):
+    return st2tm.readData(base_directory + '/' + TMfile, data_start)
 
-def parseXML(xmlstring): 
-  
-    # create element tree object 
-    root = ET.fromstring(xmlstring) 
-    
-    #create a dictionary to store the tags
-    
-    XMLdict = dict()
-  
-    for child in root:
-        value = root.find(child.tag).text
-        XMLdict[child.tag] = value
-      
-    # return the dict
-    return XMLdict
+def readTMfile(TMfile,base_directory,lines):
+    header, data_start = readTMheader(TMfile, base_directory, lines)
+    return header, readTMpayload(TMfile, base_directory, data_start)
 
+def readDataFile(TMfile, base_directory):
+    return st2tm.readData(base_directory + '/' + TMfile)
 
-def parseMCBData(file_name, base_directory, data):
-    csv_name = base_directory + '/' + RESULTS_DIR + '/' + file_name[:-3] + 'csv'
+def decodeMCBData(data):
+    # st2tm.decodeMCB with the decoding status printed, returns the profile start and packets
+    profile = st2tm.decodeMCB(data, columns=False)
 
-    if (os.path.exists(csv_name)):
-        print('Warning: already parsed, skipping')
-        return
+    if profile is None:
+        print("Invalid data length, no profile header")
+        return None, None
 
-    data_length = len(data)
+    print("Start time:   " + str(profile.profile_start))
+    print('Data length:  ' + str(profile.data_length))
 
-    # Make sure we have a valid number of packets in the data
-    if ((data_length - 4) % 32 != 0):
-        print("Invalid data length, contains " + str(int((data_length-4) / 32)) + " packets")
-        return
+    if not profile.valid_length:
+        print("Invalid data length, contains " + str(int((profile.data_length-4) / 32)) + " packets")
     else:
-        num_packets = int((data_length-4) / 32)
-
-    # read the header (time in seconds since standard epoch)
-    profile_start = struct.unpack_from('>I',data,0)[0]
-
-    print("Start time:   " + str(profile_start))
-    print('Data length:  ' + str(data_length))
-    print("Num packets:  " + str(num_packets))
-
-    with open(csv_name, mode='w') as csv_file:
-        # create a header for the CSV file
-        header = ['Elapsed Time', 'Reel Torque Avg', 'Reel Torque Max', 'LW Torque Avg', 'LW Torque Max', 'Reel Curr Avg', 
-                  'Reel Curr Max', 'LW Curr Avg', 'LW Curr Max', 'Differential Reel Speed', 'Reel Position', 
-                  'LW Position', 'Enum', 'Reel Temp Avg', 'Reel Temp Max', 'LW Temp Avg', 'LW Temp Max', 'MC1 Temp Avg', 
-                  'MC1 Temp Max', 'MC2 Temp Avg', 'MC2 Temp Max', 'Brake Curr Avg', 'Brake Curr Max', 'Supply Volt Avg', 
-                  'Supply Volt Max']
+        print("Num packets:  " + str(int((profile.data_length-4) / 32)))
+        for itr in profile.bad_sync:
+            print("Bad sync, packet #" + str(itr+1))
+
+    if profile.gaps is not None:
+        print("Resynced:     " + str(len(profile.packets)) + " packets recovered, " +
+              str(sum(length for offset, length in profile.gaps)) + " bytes skipped in " + str(len(profile.gaps)) + " gaps")
+        for offset, length in profile.gaps:
+            print("Gap:          " + str(length) + " bytes at offset " + str(offset))
+
+    return profile.profile_start, profile.packets
+
+def csvColumn(values, zero_raw=None, as_int=False):
+    # format a column for the CSV: '-' where absent, an integer 0 where the raw value was 0
+    present = ~np.isnan(values)
+    if as_int:
+        values = np.where(present, values, 0).astype(np.int64)
+
+    # most columns come from 16-bit raw values, so each distinct value is formatted once
+    # (keyed on its bits, so that -0.0 keeps its sign)
+    bits, inverse = np.unique(values.view(np.int64), return_inverse=True)
+    column = np.array([str(value) for value in bits.view(values.dtype).tolist()], dtype=object)[inverse]
+    column[~present] = '-'
+    if zero_raw is not None:
+        column[present & (zero_raw == 0)] = '0'
+    return column
+
+def writeMCBcsv(csv_name, profile_start, packets, columns):
+    # raw values for the columns that report an exact 0 when the sensor reads 0
+    zero_raw = {'Reel Torque Avg': packets['reel_torque_avg'], 'Reel Torque Max': packets['reel_torque_max'],
+                'LW Torque Avg': packets['lw_torque_avg'], 'LW Torque Max': packets['lw_torque_max']}
+    for avg_name, max_name in ROTATING_CHANNELS[:4]:
+        zero_raw[avg_name] = packets['rot_avg']
+        zero_raw[max_name] = packets['rot_max']
+
+    int_columns = ['Enum', 'Brake Curr Avg', 'Brake Curr Max']
+    csv_columns = [csvColumn(columns[name].astype(np.float64), zero_raw.get(name), name in int_columns).tolist()
+                   for name in CSV_HEADER]
+
+    # newline='' so that the rows end in '\r\n' on every platform, not '\r\r\n' on Windows
+    with open(csv_name, mode='w', newline='') as csv_file:
         csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
         csv_writer.writerow(['Start time (s)', profile_start])
         csv_writer.writerow(['Start time (UTC)', datetime.fromtimestamp(profile_start).strftime('%Y-%m-%d %H:%M:%S')])
-        csv_writer.writerow(header)
-
-        # parse all of the packets
-        packet_start_index = 4
-        for itr in range(num_packets):
-            packet_data = ['-']*25
-            
-            packet = struct.unpack_from('>BHBHHHHHHHHHHff',data,packet_start_index+itr*32)
-
-            # make sure the sync byte is valid
-            if packet[0] != 0xA5:
-                print("Bad sync, packet #" + itr+1)
-                continue # skip to next packet
-
-            # get the regular TM
-            packet_data[0] = packet[1]/10.0 # ellapsed time
-            packet_data[1] =  0 if (0 == packet[5]) else(packet[5] - 30000)/10.0 # reel torque avg
-            packet_data[2] =  0 if (0 == packet[6]) else(packet[6] - 30000)/10.0 # reel torque max
-            packet_data[3] =  0 if (0 == packet[7]) else(packet[7] - 30000)/10.0 # lw torque avg
-            packet_data[4] =  0 if (0 == packet[8]) else(packet[8] - 30000)/10.0 # lw torque max
-            packet_data[5] = SENSE_CURR_SLOPE * ((VREF/PULLDOWN_RESISTOR) * (packet[9]/MAX_ADC_READ) - I_OFFSET) # reel curr avg
-            packet_data[6] = SENSE_CURR_SLOPE * ((VREF/PULLDOWN_RESISTOR) * (packet[10]/MAX_ADC_READ) - I_OFFSET) # reel curr max
-            packet_data[7] = SENSE_CURR_SLOPE * ((VREF/PULLDOWN_RESISTOR) * (packet[11]/MAX_ADC_READ) - I_OFFSET) # lw curr avg
-            packet_data[8] = SENSE_CURR_SLOPE * ((VREF/PULLDOWN_RESISTOR) * (packet[12]/MAX_ADC_READ) - I_OFFSET) # lw curr max
-            if (itr > 0):
-                packet_data[9] = (packet[13] - last_reel_pos) / (packet_data[0] - last_time) * 60
-            packet_data[10] = packet[13] # reel position
-            packet_data[11] = packet[14] # lw position
-
-            # update tracking variables
-            last_reel_pos = packet[13]
-            last_time = packet_data[0]
-
-            # get the rotating TM
-            packet_data[12] = packet[2]
-            if (0 == packet[2]): # reel temp
-                packet_data[13] = 0 if (0 == packet[3]) else (packet[3] - 30000)/10.0
-                packet_data[14] = 0 if (0 == packet[4]) else (packet[4] - 30000)/10.0
-            elif (1 == packet[2]): # lw temp
-                packet_data[15] = 0 if (0 == packet[3]) else (packet[3] - 30000)/10.0
-                packet_data[16] = 0 if (0 == packet[4]) else (packet[4] - 30000)/10.0
-            elif (2 == packet[2]): # mc1 temp
-                packet_data[17] = 0 if (0 == packet[3]) else (packet[3] - 30000)/10.0
-                packet_data[18] = 0 if (0 == packet[4]) else (packet[4] - 30000)/10.0
-            elif (3 == packet[2]): # mc2 temp
-                packet_data[19] = 0 if (0 == packet[3]) else (packet[3] - 30000)/10.0
-                packet_data[20] = 0 if (0 == packet[4]) else (packet[4] - 30000)/10.0
-            elif (4 == packet[2]): # brake curr
-                packet_data[21] = packet[3]
-                packet_data[22] = packet[4]
-            elif (5 == packet[2]): # supply voltage
-                packet_data[23] = VREF * (packet[3]/MAX_ADC_READ) / SUPPLY_VOLT_DIV
-                packet_data[24] = VREF * (packet[4]/MAX_ADC_READ) / SUPPLY_VOLT_DIV
-
-            csv_writer.writerow(packet_data)
-
-    print('Results in:   ' + csv_name)
-
-
-def processMCBwXML(file_name, base_directory):
+        csv_writer.writerow(CSV_HEADER)
+        # the cells need no quoting, so the rows are joined directly as csv_writer would write them
+        csv_file.writelines(','.join(row) + '\r\n' for row in zip(*csv_columns))
+
+def writeMCBnpz(npz_name, profile_start, columns):
+    # typed columns (NaN where a rotating channel is absent) plus the profile start time
+    np.savez_compressed(npz_name, profile_start=np.uint32(profile_start), **columns)
+
+def loadMCBnpz(npz_name):
+    with np.load(npz_name) as npz_file:
+        columns = {name: npz_file[name] for name in CSV_HEADER + KINEMATICS_COLUMNS if name in npz_file}
+        profile_start = int(npz_file['profile_start'])
+
+    return profile_start, columns
+
+def loadMCBcsv(csv_name):
+    # one-pass loader for the CSVs written by writeMCBcsv, '-' placeholders become NaN
+    with open(csv_name, 'rb') as csv_file:
+        profile_start = int(csv_file.readline().split(b',')[1])
+        csv_file.readline() # start time (UTC)
+        header = csv_file.readline().decode().strip().split(',')
+        text = csv_file.read()
+
+    # CSVs written on Windows before the rows were written with newline='' end in '\r\r\n'
+    text = text.replace(b'\r', b'')
+
+    # two passes, as neighbouring placeholders share a comma
+    text = text.replace(b',-,', b',nan,').replace(b',-,', b',nan,')
+    text = text.replace(b',-\n', b',nan\n')
+
+    # a profile without packets has only the header lines
+    if text.strip():
+        data = np.loadtxt(io.BytesIO(text), delimiter=',', ndmin=2)
+    else:
+        data = np.zeros((0, len(header)))
+
+    columns = {name: data[:,itr] for itr, name in enumerate(header)}
+    columns['Enum'] = columns['Enum'].astype(np.uint8)
+
+    return profile_start, columns
+
+def loadMCBProfile(file_name):
+    # load a decoded profile from either output format
+    if file_name.endswith('.npz'):
+        return loadMCBnpz(file_name)
+    else:
+        return loadMCBcsv(file_name)
+
+def parseMCBData(file_name, base_directory, data, overwrite=False, npz=False, window=SMOOTHING_WINDOW, circumference=None):
+    # returns the profile start and columns (with the kinematics), (None, None) if not decodable
+    # a profile that was already parsed is loaded from its CSV
+    csv_name = base_directory + '/' + RESULTS_DIR + '/' + file_name[:-3] + 'csv'
+    npz_name = base_directory + '/' + RESULTS_DIR + '/' + file_name[:-3] + 'npz'
+
+    write_csv = overwrite or not os.path.exists(csv_name)
+    write_npz = npz and (overwrite or not os.path.exists(npz_name))
+
+    if (not write_csv and not write_npz):
+        print('Warning: already parsed, loading ' + csv_name)
+        profile_start, columns = loadMCBcsv(csv_name)
+        with st2tm.stats.stage('kinematics'):
+            columns.update(st2tm.profileKinematics(columns, window, circumference))
+        return profile_start, columns
+
+    with st2tm.stats.stage('decode'):
+        profile_start, packets = decodeMCBData(data)
+        if packets is None:
+            return None, None
+
+        columns = mcbColumns(packets)
+
+    with st2tm.stats.stage('kinematics'):
+        columns.update(st2tm.profileKinematics(columns, window, circumference))
+
+    if write_csv:
+        with st2tm.stats.stage('csv'):
+            writeMCBcsv(csv_name, profile_start, packets, columns)
+        print('Results in:   ' + csv_name)
+
+    if write_npz:
+        with st2tm.stats.stage('npz'):
+            writeMCBnpz(npz_name, profile_start, columns)
+        print('Results in:   ' + npz_name)
+
+    return profile_start, columns
+
+
+def processMCBwXML(file_name, base_directory, npz=False, window=SMOOTHING_WINDOW, circumference=None):
     print('---- Processing ' + base_directory + '/' + file_name + ' ----')
-    XMLstring, data = readTMfile(file_name,base_directory,7)
-    XMLvals = parseXML(XMLstring)
-    print('Status:       ' + XMLvals['StateFlag1'])
-    print('Message:      ' + XMLvals['StateMess1'])
-    parseMCBData(file_name, base_directory, data[5:-5])
+    frame = st2tm.readFrame(base_directory + '/' + file_name)
+    print('Status:       ' + frame.header['StateFlag1'])
+    print('Message:      ' + frame.header['StateMess1'])
+    parseMCBData(file_name, base_directory, frame.payload, npz=npz, window=window, circumference=circumference)
     print('')
 
-def processMCBwoXML(file_name, base_directory):
+def processMCBwoXML(file_name, base_directory, npz=False, window=SMOOTHING_WINDOW, circumference=None):
     print('---- Processing ' + base_directory + '/' + file_name + ' ----')
     data = readDataFile(file_name, base_directory)
-    parseMCBData(file_name, base_directory, data)
+    parseMCBData(file_name, base_directory, data, npz=npz, window=window, circumference=circumference)
 
 def main():
-    num_args = len(sys.argv)
+    parser = argparse.ArgumentParser(description='Process MCB data files')
+    parser.add_argument('files', nargs='+', help='TM files to process')
+    parser.add_argument('--npz', action='store_true', help='also write typed columns to a .npz next to each CSV')
+    parser.add_argument('--window', type=int, default=SMOOTHING_WINDOW, help='kinematics smoothing window in packets')
+    parser.add_argument('--circumference', type=float, help='cable length per unit of reel position, for the payout')
+    args = parser.parse_args()
 
     # process each specified file
-    for itr in range(num_args - 1):
+    for file_path in args.files:
         # make sure the results directory exists for the file
-        base_directory, file_name = sys.argv[itr+1].rsplit('/',1)
+        base_directory, file_name = file_path.rsplit('/',1)
         results_directory = base_directory + '/' + RESULTS_DIR + '/'
 
         if not os.path.exists(base_directory + '/' + RESULTS_DIR + '/'):
             os.mkdir(base_directory + '/' + RESULTS_DIR)
 
-        processMCBwXML(file_name, base_directory)
+        processMCBwXML(file_name, base_directory, args.npz, args.window, args.circumference)
       
 if __name__ == "__main__": 
   
@@ -6,103 +6,230 @@ import glob
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdate
 import sys
+import os
+import argparse
+import concurrent.futures
 import time
 from datetime import datetime
+import MCB_TM
+import st2tm
 
 
-def PlotCSV(filepath):
-    print('Plotting: ' + filepath)
-    data = np.genfromtxt(filepath, delimiter = ',', skip_header = 3)
-    time = data[:,0]
+# Overlay panels: (subplot, column, y label)
+OVERLAY_PANELS = [(1, 'Reel Torque Avg', 'Torque (N)'), (2, 'Reel Curr Avg', 'Current (A)'),
+                  (3, 'Reel Temp Avg', 'Temperature (C)'), (4, 'MC1 Temp Avg', 'Temperature (C)'),
+                  (5, 'LW Curr Avg', 'Current (A)'), (6, 'LW Temp Avg', 'Temperature (C)'),
+                  (7, 'Supply Volt Avg', 'Voltage (V)'), (8, 'Reel Position', 'Position (revs)'),
+                  (9, 'LW Position', 'Position (mm)')]
 
-    reel_temp_indices = ~np.isnan(data[:,13])
-    lw_temp_indices = ~np.isnan(data[:,15])
-    mc1_temp_indices = ~np.isnan(data[:,17])
-    voltage_indices = ~np.isnan(data[:,23])
 
-    plt.figure()
+def DrawProfile(data, rotating='interp'):
+    # elapsed time continued across the counter wraps, shared with the rotating TM
+    time = st2tm.unwrapElapsed(data['Elapsed Time'])
+
+    # dense rotating TM series (temperatures, voltage), see st2tm/rotating.py
+    dense = st2tm.densifyRotating(data, rotating)
+    dense_time = dense['Elapsed Time']
 
     plt.subplot(3,3,1)
-    plt.plot(time,data[:,1], label='Reel Torque')
-    plt.plot(time,data[:,2],'r--', label='Max')
-    plt.plot(time,data[:,1] - (data[:,2] - data[:,1]),'r--', label='Min')
+    plt.plot(time,data['Reel Torque Avg'], label='Reel Torque')
+    plt.plot(time,data['Reel Torque Max'],'r--', label='Max')
+    plt.plot(time,data['Reel Torque Avg'] - (data['Reel Torque Max'] - data['Reel Torque Avg']),'r--', label='Min')
     plt.legend(loc='lower right', fontsize = 'small')
     #plt.xlabel('Time (s)')
     plt.ylabel('Torque (N)')
     #plt.title('Reel Torque')
 
     plt.subplot(3,3,2)
-    plt.plot(time,data[:,5], label='Reel Current')
-    plt.plot(time,data[:,6],'r--', label='Max')
-    plt.plot(time,data[:,5] - (data[:,6] - data[:,5]),'r--', label='Min')
+    plt.plot(time,data['Reel Curr Avg'], label='Reel Current')
+    plt.plot(time,data['Reel Curr Max'],'r--', label='Max')
+    plt.plot(time,data['Reel Curr Avg'] - (data['Reel Curr Max'] - data['Reel Curr Avg']),'r--', label='Min')
     plt.legend(loc='lower right', fontsize = 'small')
     #plt.xlabel('Time (s)')
     plt.ylabel('Current (A)')
     #plt.title('Reel Current')
 
     plt.subplot(3,3,3)
-    plt.plot(time[reel_temp_indices],data[reel_temp_indices,13], label='Reel Temp')
-    plt.plot(time[reel_temp_indices],data[reel_temp_indices,14], 'r--', label='Max')
-    plt.plot(time[reel_temp_indices],2*data[reel_temp_indices,13]-data[reel_temp_indices,14], 'r--', label='Min')
+    plt.plot(dense_time,dense['Reel Temp Avg'], label='Reel Temp')
+    plt.plot(dense_time,dense['Reel Temp Max'], 'r--', label='Max')
+    plt.plot(dense_time,2*dense['Reel Temp Avg']-dense['Reel Temp Max'], 'r--', label='Min')
     plt.legend(loc='lower right', fontsize = 'small')
     #plt.xlabel('Time (s)')
     plt.ylabel('Temperature (C)')
     #plt.title('Reel Temperature')
 
     plt.subplot(3,3,4)
-    plt.plot(time[mc1_temp_indices],data[mc1_temp_indices,17], label='MC1 Temp')
-    plt.plot(time[mc1_temp_indices],data[mc1_temp_indices,18], 'r--', label='Max')
-    plt.plot(time[mc1_temp_indices],2*data[mc1_temp_indices,17]-data[mc1_temp_indices,18], 'r--', label='Min')
+    plt.plot(dense_time,dense['MC1 Temp Avg'], label='MC1 Temp')
+    plt.plot(dense_time,dense['MC1 Temp Max'], 'r--', label='Max')
+    plt.plot(dense_time,2*dense['MC1 Temp Avg']-dense['MC1 Temp Max'], 'r--', label='Min')
     plt.legend(loc='lower right', fontsize = 'small')
     #plt.xlabel('Time (s)')
     plt.ylabel('Temperature (C)')
     #plt.title('MC1 Temperature')
 
     plt.subplot(3,3,5)
-    plt.plot(time,data[:,7], label='LW Current')
-    plt.plot(time,data[:,8],'r--', label='Max')
-    plt.plot(time,data[:,7] - (data[:,8] - data[:,7]),'r--', label='Min')
+    plt.plot(time,data['LW Curr Avg'], label='LW Current')
+    plt.plot(time,data['LW Curr Max'],'r--', label='Max')
+    plt.plot(time,data['LW Curr Avg'] - (data['LW Curr Max'] - data['LW Curr Avg']),'r--', label='Min')
     plt.legend(loc='lower right', fontsize = 'small')
     #plt.xlabel('Time (s)')
     plt.ylabel('Current (A)')
     #plt.title('LW Current')
 
     plt.subplot(3,3,6)
-    plt.plot(time[lw_temp_indices],data[lw_temp_indices,15], label='LW Temp')
-    plt.plot(time[lw_temp_indices],data[lw_temp_indices,16], 'r--', label='Max')
-    plt.plot(time[lw_temp_indices],2*data[lw_temp_indices,15]-data[lw_temp_indices,16], 'r--', label='Min')
+    plt.plot(dense_time,dense['LW Temp Avg'], label='LW Temp')
+    plt.plot(dense_time,dense['LW Temp Max'], 'r--', label='Max')
+    plt.plot(dense_time,2*dense['LW Temp Avg']-dense['LW Temp Max'], 'r--', label='Min')
     plt.legend(loc='lower right', fontsize = 'small')
     #plt.xlabel('Time (s)')
     plt.ylabel('Temperature (C)')
     #plt.title('LW Temperature')
 
     plt.subplot(3,3,7)
-    plt.plot(time[voltage_indices],data[voltage_indices,23], label='Voltage')
-    plt.plot(time[voltage_indices],data[voltage_indices,24], 'r--', label='Max')
-    plt.plot(time[voltage_indices],2*data[voltage_indices,23]-data[voltage_indices,24], 'r--', label='Min')
+    plt.plot(dense_time,dense['Supply Volt Avg'], label='Voltage')
+    plt.plot(dense_time,dense['Supply Volt Max'], 'r--', label='Max')
+    plt.plot(dense_time,2*dense['Supply Volt Avg']-dense['Supply Volt Max'], 'r--', label='Min')
     plt.legend(loc='lower right', fontsize = 'small')
     plt.xlabel('Time (s)')
     plt.ylabel('Voltage (V)')
     #plt.title('MC1 Temperature')
 
     plt.subplot(3,3,8)
-    plt.plot(time,data[:,10], label='Reel Position')
+    plt.plot(time,data['Reel Position'], label='Reel Position')
     plt.legend(loc='lower right', fontsize = 'small')
     plt.xlabel('Time (s)')
     plt.ylabel('Position (revs)')
     #plt.title('Reel Position')
 
     plt.subplot(3,3,9)
-    plt.plot(time,data[:,11], label='LW Position')
+    plt.plot(time,data['LW Position'], label='LW Position')
     plt.legend(loc='lower right', fontsize = 'small')
     plt.xlabel('Time (s)')
     plt.ylabel('Position (mm)')
     #plt.title('LW Position')
 
+
+def PlotCSV(filepath, rotating='interp'):
+    print('Plotting: ' + filepath)
+    profile_start, data = MCB_TM.loadMCBProfile(filepath)
+
+    plt.figure()
+    DrawProfile(data, rotating)
     plt.show()
 
 
+def SaveCSV(filepath, output_dir, file_format='png', rotating='interp'):
+    # render without a display, for batch runs
+    plt.switch_backend('Agg')
+
+    print('Saving plot: ' + filepath)
+    profile_start, data = MCB_TM.loadMCBProfile(filepath)
+    plot_name = os.path.join(output_dir, os.path.splitext(os.path.basename(filepath))[0] + '.' + file_format)
+
+    fig = plt.figure(figsize=(16, 10))
+    DrawProfile(data, rotating)
+    fig.suptitle(os.path.basename(filepath))
+    fig.savefig(plot_name)
+    plt.close(fig)
+
+    return plot_name
+
+
+def SaveAll(filepaths, output_dir, file_format='png', jobs=1, rotating='interp'):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if jobs <= 1:
+        return [SaveCSV(filepath, output_dir, file_format, rotating) for filepath in filepaths]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(SaveCSV, filepath, output_dir, file_format, rotating) for filepath in filepaths]
+        return [future.result() for future in futures]
+
+
+def MinMaxDecimate(x, y, max_points):
+    # keep the min and max of each bin so that peaks survive the decimation
+    valid = ~np.isnan(y)
+    x = x[valid]
+    y = y[valid]
+
+    if len(y) <= max_points:
+        return x, y
+
+    bin_size = -(-2 * len(y) // max_points)
+    starts = np.arange(0, len(y), bin_size)
+    y_min = np.minimum.reduceat(y, starts)
+    y_max = np.maximum.reduceat(y, starts)
+    x_mid = x[np.minimum(starts + bin_size // 2, len(x) - 1)]
+
+    return np.repeat(x_mid, 2), np.column_stack((y_min, y_max)).ravel()
+
+
+def PlotOverlay(filepaths, max_points=2000, output_name=None, rotating='interp'):
+    # overlay several profiles on shared axes in absolute UTC time
+    fig = plt.figure(figsize=(16, 10))
+    axes = dict()
+    for subplot, column, ylabel in OVERLAY_PANELS:
+        axes[column] = fig.add_subplot(3, 3, subplot, sharex=axes.get('Reel Torque Avg'))
+        axes[column].set_ylabel(ylabel)
+        axes[column].set_title(column, fontsize='small')
+
+    for filepath in filepaths:
+        print('Overlaying: ' + filepath)
+        profile_start, data = MCB_TM.loadMCBProfile(filepath)
+        dense = st2tm.densifyRotating(data, rotating)
+        utc = ((profile_start + dense['Elapsed Time']) * 1000).astype('datetime64[ms]')
+
+        for subplot, column, ylabel in OVERLAY_PANELS:
+            series = dense.get(column)
+            if series is None:
+                if 'resample' == rotating:
+                    series = np.interp(dense['Elapsed Time'], st2tm.unwrapElapsed(data['Elapsed Time']), data[column])
+                else:
+                    series = data[column]
+            x, y = MinMaxDecimate(utc, series, max_points)
+            axes[column].plot(x, y, linewidth=0.8, label=os.path.basename(filepath))
+
+    for subplot, column, ylabel in OVERLAY_PANELS:
+        axes[column].xaxis.set_major_formatter(mdate.DateFormatter('%m-%d %H:%M'))
+        axes[column].tick_params(axis='x', labelsize='small', labelrotation=30)
+    axes['Reel Torque Avg'].legend(loc='lower right', fontsize='x-small')
+    fig.tight_layout()
+
+    if output_name is None:
+        plt.show()
+    else:
+        fig.savefig(output_name)
+        plt.close(fig)
+        print('Overlay in: ' + output_name)
+
+
 if __name__ == "__main__":
-    num_args = len(sys.argv)
-    for itr in range(num_args-1):
-        PlotCSV(sys.argv[itr+1])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Plot MCB profiles')
+    parser.add_argument('files', nargs='+', help='profile CSV/NPZ files (glob patterns are expanded)')
+    parser.add_argument('--save', metavar='DIR', help='render without a display and save the plots to DIR')
+    parser.add_argument('--format', default='png', choices=['png', 'pdf'], help='file format for --save')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes used for --save')
+    parser.add_argument('--overlay', action='store_true', help='overlay all profiles on shared UTC axes')
+    parser.add_argument('--max-points', type=int, default=2000, help='points per series in the overlay')
+    parser.add_argument('--rotating', default='interp', choices=st2tm.ROTATING_METHODS,
+                        help='how the rotating TM channels are made dense (default: interp)')
+    args = parser.parse_args()
+
+    filepaths = []
+    for pattern in args.files:
+        filepaths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    if args.overlay:
+        if args.save is not None:
+            plt.switch_backend('Agg')
+            if not os.path.exists(args.save):
+                os.makedirs(args.save)
+            PlotOverlay(filepaths, args.max_points, os.path.join(args.save, 'overlay.' + args.format), args.rotating)
+        else:
+            PlotOverlay(filepaths, args.max_points, rotating=args.rotating)
+    elif args.save is not None:
+        SaveAll(filepaths, args.save, args.format, args.jobs, args.rotating)
+    else:
+        for filepath in filepaths:
+            PlotCSV(filepath, args.rotating)
\ No newline at end of file
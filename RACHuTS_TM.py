@@ -9,95 +9,269 @@ To use this script to process the RACHuTS TM files:
     First run "python3 retrieve_st2_data.py"
     Then run "python3 RACHuTS_TM.py FullTM*/*.dat"
 
+To decode the files in parallel with N processes:
+
+    python3 RACHuTS_TM.py --jobs N FullTM*/*.dat
+
 The resulting MCB CSVs and TM text will be placed in the directory FullTM*/Processed_Data/
+and every file is added to profile_index.sqlite (see RACHuTS_index.py to query it)
+
+MCB profiles are checked against the limits in RACHuTS_alarms_cfg.py; out-of-limit
+events are printed, noted in messages.txt and appended to FullTM*/Processed_Data/alarm_events.csv
+
+Decoded profiles are also appended to the flight-wide UTC time series in flight_store/
+(see RACHuTS_store.py to slice it), unless --no-store is given
+
+To keep syncing and processing new files as they arrive, run "python3 RACHuTS_watch.py"
 """
 
 import csv
-import xml.etree.ElementTree as ET
 import struct
 import time
 from datetime import datetime
 import sys
 import os
+import argparse
+import concurrent.futures
+import functools
 import MCB_TM
+import st2tm
+import RACHuTS_index
+import RACHuTS_alarms_cfg
+import RACHuTS_store
 
 # Results directory
 RESULTS_DIR = 'Processed_Data'
 
-def readTMfile(TMfile,base_directory,lines):
-    with open(base_directory + '/' + TMfile, 'rb') as TM_file:
-        header = [next(TM_file).decode() for x in range(lines)]
-        TM_file.readline()
-        data = TM_file.readlines()
+# Processed files ledger, one 'name\tsize\tmtime_ns' line per processed frame
+LEDGER_FILE = 'processed_files.txt'
 
-    return ''.join(header), b''.join(data)
+# Frames that could not be processed, one 'name\terror' line per failure
+FAILED_FILE = 'failed_files.txt'
 
-def readDataFile(TMfile, base_directory):
-    with open(base_directory + '/' + TMfile, 'rb') as TM_file:
-        data = TM_file.readlines()
+# Alarm event CSV columns
+ALARM_EVENT_FIELDS = ['file', 'profile_start', 'alarm', 'column', 'limit', 'peak', 'start_utc', 'end_utc',
+                      'start', 'end', 'packets']
 
-    return b''.join(data)
+readTMfile = MCB_TM.readTMfile
+readTMheader = MCB_TM.readTMheader
+readTMpayload = MCB_TM.readTMpayload
+readDataFile = MCB_TM.readDataFile
+parseXML = MCB_TM.parseXML
 
-def parseXML(xmlstring):
+def fileStamp(file_path):
+    # size and modification time identify the version of a frame that was processed
+    file_stat = os.stat(file_path)
+    return (file_stat.st_size, file_stat.st_mtime_ns)
 
-    # create element tree object
-    root = ET.fromstring(xmlstring)
+def loadLedger(base_directory):
+    # file name -> stamp of the frame when it was processed (None for entries without a stamp)
+    ledger = dict()
 
-    #create a dictionary to store the tags
+    if os.path.exists(base_directory + '/' + RESULTS_DIR + '/' + LEDGER_FILE):
+        with open(base_directory + '/' + RESULTS_DIR + '/' + LEDGER_FILE, 'r') as processed_files:
+            for line in processed_files:
+                fields = line.rstrip('\n').split('\t')
+                if 3 == len(fields):
+                    ledger[fields[0]] = (int(fields[1]), int(fields[2]))
+                elif fields[0]:
+                    ledger[fields[0]] = None
 
-    XMLdict = dict()
+    return ledger
 
-    for child in root:
-        value = root.find(child.tag).text
-        XMLdict[child.tag] = value
+def appendLedger(base_directory, file_name, stamp):
+    with open(base_directory + '/' + RESULTS_DIR + '/' + LEDGER_FILE, 'a') as processed_files:
+        processed_files.write(file_name + '\t' + str(stamp[0]) + '\t' + str(stamp[1]) + '\n')
 
-    # return the dict
-    return XMLdict
+def appendAlarmEvents(base_directory, events):
+    events_name = base_directory + '/' + RESULTS_DIR + '/' + RACHuTS_alarms_cfg.alarm_events_filename
+    new_file = not os.path.exists(events_name)
+    with open(events_name, 'a', newline='') as events_file:
+        events_writer = csv.DictWriter(events_file, fieldnames=ALARM_EVENT_FIELDS)
+        if new_file:
+            events_writer.writeheader()
+        events_writer.writerows(events)
 
-def processFile(file_name, base_directory):
-    with open(base_directory + '/' + RESULTS_DIR + '/messages.txt', 'a') as message_file:
-        message_file.write('---- File: ' + base_directory + '/' + file_name + ' ----\n')
+def dropAlarmEvents(base_directory, file_name):
+    # removes a reprocessed file's earlier events, so the log only holds those of its latest frame
+    events_name = base_directory + '/' + RESULTS_DIR + '/' + RACHuTS_alarms_cfg.alarm_events_filename
+    if not os.path.exists(events_name):
+        return
+    with open(events_name, 'r', newline='') as events_file:
+        all_events = list(csv.DictReader(events_file))
+    events = [event for event in all_events if event['file'] != base_directory + '/' + file_name]
+    if len(events) == len(all_events):
+        return
+    with open(events_name + '.tmp', 'w', newline='') as events_file:
+        events_writer = csv.DictWriter(events_file, fieldnames=ALARM_EVENT_FIELDS)
+        events_writer.writeheader()
+        events_writer.writerows(events)
+    os.replace(events_name + '.tmp', events_name)
 
-        XMLstring, data = readTMfile(file_name,base_directory,7)
-        XMLvals = parseXML(XMLstring)
+def alarmMessage(event):
+    return ('ALARM ' + event['alarm'] + ': ' + event['column'] + ' peak ' + str(round(event['peak'], 2)) +
+            ' (limit ' + str(event['limit']) + ') from ' + event['start_utc'] + ' to ' + event['end_utc'] +
+            ', ' + str(event['packets']) + ' packets\n')
 
-        message_file.write('Status:\t' + XMLvals['StateFlag1'] + '\n')
-        message_file.write('Message ' + XMLvals['Msg'] + ':\t' + XMLvals['StateMess1'] + '\n')
-        if int(XMLvals['Length']) != 0:
-            message_file.write('Bytes: ' + XMLvals['Length'] + '\n')
+def processFile(file_name, base_directory, reprocess=False, npz=False, stats=False):
+    # returns a dict with the text for messages.txt, the st2tm.stats record (None unless stats),
+    # the profile index record, the alarm events and the decoded profile (for the flight store);
+    # the caller writes them so that batches stay in input order
+    st2tm.stats.enable(stats)
+    st2tm.stats.beginFile(base_directory + '/' + file_name)
 
-        if 'Finished' in XMLvals['StateMess1'] or 'dock condition' in XMLvals['StateMess1']:
-            MCB_TM.parseMCBData(file_name, base_directory, data[5:-5])
-            message_file.write('MCB Data Parsed\n')
+    messages = ['---- File: ' + base_directory + '/' + file_name + ' ----\n']
+    if reprocess:
+        messages.append('File changed since it was last processed\n')
 
-        message_file.write('\n')
+    # only the header is read until it shows that the frame holds MCB data
+    frame = st2tm.readFrame(base_directory + '/' + file_name)
+    XMLvals = frame.header
 
-def main():
-    num_args = len(sys.argv)
-    num_processed = 0
+    messages.append('Status:\t' + XMLvals['StateFlag1'] + '\n')
+    messages.append('Message ' + XMLvals['Msg'] + ':\t' + XMLvals['StateMess1'] + '\n')
+    if int(XMLvals['Length']) != 0:
+        messages.append('Bytes: ' + XMLvals['Length'] + '\n')
+
+    profile_start = None
+    columns = None
+    if 'MCB' == st2tm.messageType(XMLvals):
+        profile_start, columns = MCB_TM.parseMCBData(file_name, base_directory, frame.payload, overwrite=reprocess, npz=npz)
+        messages.append('MCB Data Parsed\n')
+
+    alarms = []
+    if columns is not None:
+        with st2tm.stats.stage('alarms'):
+            alarms = st2tm.evaluateAlarms(columns, RACHuTS_alarms_cfg.alarm_rules, RACHuTS_alarms_cfg.alarm_rotating_method)
+        for event in alarms:
+            event['file'] = base_directory + '/' + file_name
+            event['profile_start'] = RACHuTS_index.formatUTC(profile_start)
+            event['start_utc'] = RACHuTS_index.formatUTC(profile_start + event['start'])
+            event['end_utc'] = RACHuTS_index.formatUTC(profile_start + event['end'])
+            messages.append(alarmMessage(event))
+
+    messages.append('\n')
+
+    return {'messages': ''.join(messages), 'stats': st2tm.stats.endFile(),
+            'frame': RACHuTS_index.frameRecord(file_name, base_directory, XMLvals, profile_start, columns),
+            'alarms': alarms, 'profile': None if columns is None else (profile_start, columns), 'error': None}
+
+def tryProcessFile(file_name, base_directory, reprocess=False, npz=False, stats=False):
+    # processFile, with a frame that raises reported in its result instead of stopping the batch
+    try:
+        return processFile(file_name, base_directory, reprocess, npz, stats)
+    except Exception as err:
+        error = type(err).__name__ + ': ' + str(err)
+        return {'messages': '---- File: ' + base_directory + '/' + file_name + ' ----\nERROR: ' + error + '\n\n',
+                'stats': st2tm.stats.endFile(), 'frame': None, 'alarms': [], 'profile': None, 'error': error}
 
-    # process each specified file
-    for itr in range(num_args - 1):
-        already_processed = False
+def appendFailed(base_directory, file_name, error):
+    with open(base_directory + '/' + RESULTS_DIR + '/' + FAILED_FILE, 'a') as failed_files:
+        failed_files.write(file_name + '\t' + error.replace('\n', ' ') + '\n')
 
+def processFiles(files, jobs=1, npz=False, stats=False):
+    # yields the processFile results for each (file_name, base_directory, reprocess) in input order
+    file_names = [file_name for file_name, base_directory, reprocess in files]
+    base_directories = [base_directory for file_name, base_directory, reprocess in files]
+    reprocess_flags = [reprocess for file_name, base_directory, reprocess in files]
+    process = functools.partial(tryProcessFile, npz=npz, stats=stats)
+
+    if jobs <= 1:
+        yield from map(process, file_names, base_directories, reprocess_flags)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            yield from executor.map(process, file_names, base_directories, reprocess_flags, chunksize=4)
+
+def processPaths(file_paths, jobs=1, npz=False, ledgers=None, stats_path=None, store=True):
+    # process the files that are new or have changed, returns the number processed
+    # ledgers (base directory -> ledger) can be kept by the caller across calls
+    # with stats_path, a JSON summary of the per-stage timing and counters is written there
+    # with store, the decoded profiles are appended to the flight store
+    batch_start = time.perf_counter()
+    stats_records = []
+
+    if ledgers is None:
+        ledgers = dict()
+
+    num_processed = 0
+    to_process = []
+    stamps = []
+    queued = set()
+
+    # find the files that are new or have changed since they were processed
+    for file_path in file_paths:
         # make sure the results directory exists for the file
-        base_directory, file_name = sys.argv[itr+1].rsplit('/',1)
+        base_directory, file_name = file_path.rsplit('/',1)
+
+        if base_directory not in ledgers:
+            if not os.path.exists(base_directory + '/' + RESULTS_DIR + '/'):
+                os.mkdir(base_directory + '/' + RESULTS_DIR)
+            ledgers[base_directory] = loadLedger(base_directory)
 
-        if not os.path.exists(base_directory + '/' + RESULTS_DIR + '/'):
-            os.mkdir(base_directory + '/' + RESULTS_DIR)
+        ledger = ledgers[base_directory]
+        stamp = fileStamp(file_path)
 
-        if os.path.exists(base_directory + '/' + RESULTS_DIR + '/processed_files.txt'):
-            with open(base_directory + '/' + RESULTS_DIR + '/processed_files.txt', 'r') as processed_files:
-                for line in processed_files:
-                    if file_name in line:
-                        already_processed = True
+        # the same file given twice is only processed once
+        if (base_directory, file_name) in queued:
+            continue
+        if file_name not in ledger:
+            to_process.append((file_name, base_directory, False))
+        elif ledger[file_name] is not None and ledger[file_name] != stamp:
+            to_process.append((file_name, base_directory, True))
+        else:
+            continue
+
+        queued.add((base_directory, file_name))
+        stamps.append(stamp)
+
+    # only this process writes the messages, the index and the ledger
+    results = processFiles(to_process, jobs, npz, stats_path is not None)
+    for (file_name, base_directory, reprocess), stamp, result in zip(to_process, stamps, results):
+        num_processed += 1
+        if result['stats'] is not None:
+            stats_records.append(result['stats'])
+        if result['error'] is not None:
+            # ledgered like the others, so it is only retried once the file changes
+            print(base_directory + '/' + file_name + ' failed: ' + result['error'])
+            appendFailed(base_directory, file_name, result['error'])
+        else:
+            # indexed before the ledger, so a ledgered frame is always in the index
+            RACHuTS_index.indexFrames(RACHuTS_index.indexPath(base_directory), [result['frame']])
+        with open(base_directory + '/' + RESULTS_DIR + '/messages.txt', 'a') as message_file:
+            message_file.write(result['messages'])
+        # also when a batch that stopped before ledgering the file is processed again
+        if reprocess or result['alarms']:
+            dropAlarmEvents(base_directory, file_name)
+        if result['alarms']:
+            appendAlarmEvents(base_directory, result['alarms'])
+            for event in result['alarms']:
+                print(base_directory + '/' + file_name + ': ' + alarmMessage(event), end='')
+        if store and result['profile'] is not None:
+            profile_start, columns = result['profile']
+            RACHuTS_store.appendProfile(RACHuTS_store.storePath(base_directory),
+                                        os.path.basename(base_directory) + '/' + file_name, profile_start, columns)
+        # the kept ledger only marks the frames that are in the ledger file, so if the batch stops
+        # early, the frames after the failure are still processed when they are given again
+        appendLedger(base_directory, file_name, stamp)
+        ledgers[base_directory][file_name] = stamp
+
+    if stats_path is not None:
+        st2tm.stats.writeSummary(stats_path, stats_records, time.perf_counter() - batch_start)
+
+    return num_processed
+
+def main():
+    parser = argparse.ArgumentParser(description='Process RACHuTS TM files')
+    parser.add_argument('files', nargs='+', help='TM files to process, e.g. FullTM*/*.dat')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes used to decode files')
+    parser.add_argument('--npz', action='store_true', help='also write MCB profiles as typed NumPy columns (.npz)')
+    parser.add_argument('--stats', metavar='FILE', help='write per-file and per-stage timing and counters to FILE (JSON)')
+    parser.add_argument('--no-store', action='store_true', help='do not append the profiles to the flight store')
+    args = parser.parse_args()
 
-        if not already_processed:
-            num_processed += 1
-            processFile(file_name, base_directory)
-            with open(base_directory + '/' + RESULTS_DIR + '/processed_files.txt', 'a') as processed_files:
-                processed_files.write(file_name + '\n')
+    num_processed = processPaths(args.files, args.jobs, args.npz, stats_path=args.stats, store=not args.no_store)
 
+    base_directory = args.files[-1].rsplit('/',1)[0]
     with open(base_directory + '/' + RESULTS_DIR + '/messages.txt', 'a') as message_file:
         message_file.write('\n==== End of Files ====\n\n\n')
 
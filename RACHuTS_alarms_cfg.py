@@ -0,0 +1,21 @@
+"""
+Configuration file for the MCB profile alarms evaluated by RACHuTS_TM.py
+"""
+
+# (alarm name, column, '>' or '<', limit, minimum number of consecutive packets out of limit)
+# columns are those of the MCB CSVs, the rotating TM columns are made dense first
+alarm_rules=[
+    ('Reel overtorque', 'Reel Torque Max', '>', 60.0, 1),
+    ('LW overtorque', 'LW Torque Max', '>', 60.0, 1),
+    ('Reel overcurrent', 'Reel Curr Max', '>', 12.0, 2),
+    ('LW overcurrent', 'LW Curr Max', '>', 12.0, 2),
+    ('Reel overtemperature', 'Reel Temp Max', '>', 60.0, 1),
+    ('LW overtemperature', 'LW Temp Max', '>', 60.0, 1),
+    ('MC1 overtemperature', 'MC1 Temp Max', '>', 70.0, 1),
+    ('MC2 overtemperature', 'MC2 Temp Max', '>', 70.0, 1),
+    ('Low supply voltage', 'Supply Volt Avg', '<', 13.0, 1),
+] # Adapt according to your needs
+
+alarm_rotating_method='ffill' # 'ffill' holds each rotating TM value until the next one, or 'interp'
+
+alarm_events_filename='alarm_events.csv' # events appended in each FullTM_MM-DD-YY/Processed_Data/
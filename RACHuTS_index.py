@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Flight-level index of the processed RACHuTS TM frames.
+
+RACHuTS_TM.py adds every frame it processes to profile_index.sqlite, next to the
+FullTM_MM-DD-YY directories. Each entry holds the XML header fields, and for MCB
+profiles the start time, packet count and peak torques and currents.
+
+To query the index:
+
+    python3 RACHuTS_index.py query --message "dock condition"
+    python3 RACHuTS_index.py query --start "2021-10-01 00:00" --end "2021-10-02 12:00"
+
+To add frames processed before the index existed (reads their headers and CSVs):
+
+    python3 RACHuTS_index.py build FullTM*/*.dat
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+from datetime import datetime, timezone
+import numpy as np
+import MCB_TM
+import st2tm
+
+# Index file, placed in the directory that holds the FullTM_MM-DD-YY directories
+INDEX_FILE = 'profile_index.sqlite'
+
+# (column, type) of each index entry
+INDEX_COLUMNS = [('path', 'TEXT PRIMARY KEY'), ('file_name', 'TEXT'), ('base_directory', 'TEXT'),
+                 ('msg', 'INTEGER'), ('state_flag', 'TEXT'), ('state_mess', 'TEXT'), ('length', 'INTEGER'),
+                 ('profile_start', 'INTEGER'), ('num_packets', 'INTEGER'),
+                 ('max_reel_torque', 'REAL'), ('max_lw_torque', 'REAL'),
+                 ('max_reel_curr', 'REAL'), ('max_lw_curr', 'REAL')]
+
+# Profile summary columns: index column -> MCB column
+SUMMARY_COLUMNS = [('max_reel_torque', 'Reel Torque Max'), ('max_lw_torque', 'LW Torque Max'),
+                   ('max_reel_curr', 'Reel Curr Max'), ('max_lw_curr', 'LW Curr Max')]
+
+def indexPath(base_directory):
+    # the index sits beside the FullTM_MM-DD-YY directories
+    return os.path.join(os.path.dirname(base_directory), INDEX_FILE)
+
+def openIndex(index_path):
+    connection = sqlite3.connect(index_path)
+    connection.execute('CREATE TABLE IF NOT EXISTS frames (' +
+                       ', '.join(name + ' ' + sql_type for name, sql_type in INDEX_COLUMNS) + ')')
+    connection.execute('CREATE INDEX IF NOT EXISTS frames_profile_start ON frames (profile_start)')
+    return connection
+
+def frameRecord(file_name, base_directory, XMLvals, profile_start=None, columns=None):
+    # index entry for one frame, with the profile summary if it held MCB data
+    record = {'path': base_directory + '/' + file_name, 'file_name': file_name, 'base_directory': base_directory,
+              'msg': int(XMLvals['Msg']), 'state_flag': XMLvals['StateFlag1'], 'state_mess': XMLvals['StateMess1'],
+              'length': int(XMLvals['Length']), 'profile_start': profile_start, 'num_packets': None}
+
+    for name, column in SUMMARY_COLUMNS:
+        record[name] = None
+
+    if columns is not None:
+        record['num_packets'] = len(columns['Elapsed Time'])
+        if record['num_packets']:
+            for name, column in SUMMARY_COLUMNS:
+                record[name] = float(np.nanmax(columns[column]))
+
+    return record
+
+def indexFrames(index_path, records):
+    # add or replace the entries of a batch in one transaction
+    names = [name for name, sql_type in INDEX_COLUMNS]
+    with openIndex(index_path) as connection:
+        connection.executemany('INSERT OR REPLACE INTO frames (' + ', '.join(names) + ') VALUES (' +
+                               ', '.join('?' * len(names)) + ')',
+                               [[record[name] for name in names] for record in records])
+    connection.close()
+
+def queryIndex(index_path, message=None, flag=None, start=None, end=None, profiles_only=False):
+    # entries matching all the given conditions, in profile start then path order
+    # message is a substring of StateMess1, start and end are UTC seconds on the profile start
+    conditions = []
+    values = []
+    if message is not None:
+        conditions.append('state_mess LIKE ?')
+        values.append('%' + message + '%')
+    if flag is not None:
+        conditions.append('state_flag = ?')
+        values.append(flag)
+    if start is not None:
+        conditions.append('profile_start >= ?')
+        values.append(start)
+    if end is not None:
+        conditions.append('profile_start <= ?')
+        values.append(end)
+    if profiles_only:
+        conditions.append('profile_start IS NOT NULL')
+
+    query = 'SELECT * FROM frames'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY profile_start, path'
+
+    connection = openIndex(index_path)
+    connection.row_factory = sqlite3.Row
+    rows = [dict(row) for row in connection.execute(query, values)]
+    connection.close()
+
+    return rows
+
+def parseUTC(text):
+    # 'YYYY-MM-DD[ HH:MM[:SS]]' in UTC -> seconds since the epoch
+    return int(datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp())
+
+def formatUTC(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def buildIndex(file_paths):
+    # index frames that were processed before the index existed, from their headers and CSVs
+    records = dict()
+    for file_path in file_paths:
+        base_directory, file_name = file_path.rsplit('/',1)
+        XMLvals = st2tm.readFrame(file_path).header
+
+        profile_start = None
+        columns = None
+        csv_name = base_directory + '/' + MCB_TM.RESULTS_DIR + '/' + file_name[:-3] + 'csv'
+        if os.path.exists(csv_name):
+            profile_start, columns = MCB_TM.loadMCBcsv(csv_name)
+
+        records.setdefault(indexPath(base_directory), []).append(
+            frameRecord(file_name, base_directory, XMLvals, profile_start, columns))
+
+    for index_path, index_records in records.items():
+        indexFrames(index_path, index_records)
+        print('Indexed ' + str(len(index_records)) + ' files in ' + index_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Query or build the RACHuTS profile index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    query_parser = subparsers.add_parser('query', help='list the indexed frames matching all the conditions')
+    query_parser.add_argument('--index', default=INDEX_FILE, help='index file (default: ./' + INDEX_FILE + ')')
+    query_parser.add_argument('--message', help='substring of the state message, e.g. "dock condition"')
+    query_parser.add_argument('--flag', help='state flag, e.g. FINE')
+    query_parser.add_argument('--start', type=parseUTC, help='earliest profile start (UTC)')
+    query_parser.add_argument('--end', type=parseUTC, help='latest profile start (UTC)')
+    query_parser.add_argument('--profiles', action='store_true', help='only frames with MCB profile data')
+
+    build_parser = subparsers.add_parser('build', help='index frames that were already processed')
+    build_parser.add_argument('files', nargs='+', help='TM files, e.g. FullTM*/*.dat')
+
+    args = parser.parse_args()
+
+    if 'build' == args.command:
+        buildIndex(args.files)
+        return
+
+    if not os.path.exists(args.index):
+        sys.exit('No index at ' + args.index)
+
+    rows = queryIndex(args.index, args.message, args.flag, args.start, args.end, args.profiles)
+    for row in rows:
+        start = '-' if row['profile_start'] is None else formatUTC(row['profile_start'])
+        summary = ''
+        if row['num_packets']:
+            summary = ('  packets: ' + str(row['num_packets']) + '  max reel torque: ' + str(row['max_reel_torque']) +
+                       '  max reel curr: %.2f  max LW curr: %.2f' % (row['max_reel_curr'], row['max_lw_curr']))
+        print(row['path'] + '  ' + start + '  ' + row['state_flag'] + '  ' + row['state_mess'] + summary)
+    print(str(len(rows)) + ' matching file(s)')
+
+if __name__ == "__main__":
+
+    # calling main function
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Flight-wide store of every decoded MCB packet, in absolute UTC time.
+
+RACHuTS_TM.py appends each profile it decodes to flight_store/, next to the
+FullTM_MM-DD-YY directories and profile_index.sqlite:
+
+    packets.bin   one fixed-size record per packet: UTC (profile start + elapsed time)
+                  then the MCB columns and kinematics as float32
+    profiles.bin  one record per appended profile: UTC start and end, first packet
+                  row and packet count, and the source frame
+
+Both files are append-only and read through memory maps, so a time window is sliced
+from the profiles that overlap it without reading the rest of the flight. A profile
+appended again (after reprocessing) replaces the earlier copy.
+
+    python3 RACHuTS_store.py info
+    python3 RACHuTS_store.py slice --start "2021-10-01 00:00" --end "2021-10-08 00:00" --csv week.csv
+    python3 RACHuTS_store.py build FullTM*/Processed_Data/*.csv
+"""
+
+import argparse
+import os
+import sys
+import numpy as np
+import MCB_TM
+import RACHuTS_index
+import RACHuTS_alarms_cfg
+import st2tm
+
+# Store directory, placed in the directory that holds the FullTM_MM-DD-YY directories
+STORE_DIR = 'flight_store'
+PACKETS_FILE = 'packets.bin'
+PROFILES_FILE = 'profiles.bin'
+
+# Columns stored for each packet, after the UTC time
+STORE_COLUMNS = MCB_TM.CSV_HEADER + st2tm.KINEMATICS_COLUMNS
+
+PACKET_DTYPE = np.dtype([('UTC', '<f8')] + [(name, '<f4') for name in STORE_COLUMNS])
+
+PROFILE_DTYPE = np.dtype([('t_start', '<f8'), ('t_end', '<f8'), ('row_start', '<i8'), ('count', '<i8'),
+                          ('source', 'S200')])
+
+def storePath(base_directory):
+    # the store sits beside the FullTM_MM-DD-YY directories
+    return os.path.join(os.path.dirname(base_directory), STORE_DIR)
+
+def readRecords(file_path, dtype):
+    # memory map of the complete records of an append-only file (empty array if there are none)
+    if not os.path.exists(file_path):
+        return np.zeros(0, dtype=dtype)
+    num_records = os.path.getsize(file_path) // dtype.itemsize
+    if 0 == num_records:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', shape=(num_records,))
+
+def appendRecords(file_path, records):
+    # append after the last complete record, dropping any partial one left by an interrupted append
+    with open(file_path, 'ab') as records_file:
+        row_start = records_file.tell() // records.dtype.itemsize
+        if records_file.tell() != row_start * records.dtype.itemsize:
+            records_file.truncate(row_start * records.dtype.itemsize)
+        records.tofile(records_file)
+
+    return row_start
+
+def appendProfile(store_path, source, profile_start, columns):
+    # add a decoded profile to the store, returns its number of packets
+    num_packets = len(columns['Elapsed Time'])
+    if 0 == num_packets:
+        return 0
+
+    packets = np.empty(num_packets, dtype=PACKET_DTYPE)
+    packets['UTC'] = profile_start + st2tm.unwrapElapsed(np.asarray(columns['Elapsed Time'], dtype=np.float64))
+    for name in STORE_COLUMNS:
+        packets[name] = columns[name] if name in columns else np.nan
+
+    if not os.path.exists(store_path):
+        os.makedirs(store_path)
+
+    # the packets go first, so a profile record never points past the end of the packets
+    row_start = appendRecords(os.path.join(store_path, PACKETS_FILE), packets)
+
+    profile = np.zeros(1, dtype=PROFILE_DTYPE)
+    profile['t_start'] = packets['UTC'].min()
+    profile['t_end'] = packets['UTC'].max()
+    profile['row_start'] = row_start
+    profile['count'] = num_packets
+    profile['source'] = source.encode()
+    appendRecords(os.path.join(store_path, PROFILES_FILE), profile)
+
+    return num_packets
+
+def loadProfiles(store_path):
+    # the current profile records, in UTC start order (a source appended again keeps its last copy)
+    profiles = np.array(readRecords(os.path.join(store_path, PROFILES_FILE), PROFILE_DTYPE))
+    if 0 == len(profiles):
+        return profiles
+
+    last = len(profiles) - 1 - np.unique(profiles['source'][::-1], return_index=True)[1]
+    profiles = profiles[last]
+
+    return profiles[np.argsort(profiles['t_start'], kind='stable')]
+
+def sliceWindow(store_path, start=None, end=None, columns=None):
+    # packets with start <= UTC <= end (UTC seconds, None for open ends), returns a dict of arrays in UTC order
+    names = ['UTC'] + (STORE_COLUMNS if columns is None else [name for name in columns if name != 'UTC'])
+    start = -np.inf if start is None else start
+    end = np.inf if end is None else end
+
+    profiles = loadProfiles(store_path)
+    profiles = profiles[(profiles['t_end'] >= start) & (profiles['t_start'] <= end)]
+    packets = readRecords(os.path.join(store_path, PACKETS_FILE), PACKET_DTYPE)
+
+    pieces = []
+    for profile in profiles:
+        rows = packets[profile['row_start']:profile['row_start'] + profile['count']]
+        utc = rows['UTC']
+
+        # profiles are almost always in time order, only fall back to a mask when they are not
+        if np.all(utc[1:] >= utc[:-1]):
+            rows = rows[np.searchsorted(utc, start, side='left'):np.searchsorted(utc, end, side='right')]
+        else:
+            rows = rows[(utc >= start) & (utc <= end)]
+
+        pieces.append({name: np.array(rows[name]) for name in names})
+
+    window = {name: np.concatenate([piece[name] for piece in pieces]) if pieces else np.zeros(0)
+              for name in names}
+
+    # overlapping profiles are interleaved into one time series
+    if len(pieces) > 1:
+        order = np.argsort(window['UTC'], kind='stable')
+        window = {name: values[order] for name, values in window.items()}
+
+    return window
+
+def buildStore(file_paths):
+    # store profiles decoded before the store existed, from their CSV or NPZ files
+    num_profiles = dict()
+    for file_path in file_paths:
+        results_directory, file_name = os.path.split(file_path)
+        if file_name == RACHuTS_alarms_cfg.alarm_events_filename:
+            continue
+        base_directory = os.path.dirname(results_directory)
+        profile_start, columns = MCB_TM.loadMCBProfile(file_path)
+        if st2tm.KINEMATICS_COLUMNS[0] not in columns:
+            columns.update(st2tm.profileKinematics(columns))
+
+        store_path = storePath(base_directory)
+        source = os.path.basename(base_directory) + '/' + os.path.splitext(file_name)[0] + '.dat'
+        appendProfile(store_path, source, profile_start, columns)
+        num_profiles[store_path] = num_profiles.get(store_path, 0) + 1
+
+    for store_path, count in num_profiles.items():
+        print('Stored ' + str(count) + ' profiles in ' + store_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect, slice or build the RACHuTS flight store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    info_parser = subparsers.add_parser('info', help='list the stored profiles')
+    info_parser.add_argument('--store', default=STORE_DIR, help='store directory (default: ./' + STORE_DIR + ')')
+
+    slice_parser = subparsers.add_parser('slice', help='packets in a UTC time window')
+    slice_parser.add_argument('--store', default=STORE_DIR, help='store directory (default: ./' + STORE_DIR + ')')
+    slice_parser.add_argument('--start', type=RACHuTS_index.parseUTC, help='window start (UTC)')
+    slice_parser.add_argument('--end', type=RACHuTS_index.parseUTC, help='window end (UTC)')
+    slice_parser.add_argument('--columns', nargs='+', help='columns to keep, e.g. "Supply Volt Avg"')
+    slice_parser.add_argument('--csv', help='write the window to this CSV')
+
+    build_parser = subparsers.add_parser('build', help='store profiles that were already decoded')
+    build_parser.add_argument('files', nargs='+', help='profile CSV/NPZ files, e.g. FullTM*/Processed_Data/*.csv')
+
+    args = parser.parse_args()
+
+    if 'build' == args.command:
+        buildStore(args.files)
+        return
+
+    if not os.path.exists(os.path.join(args.store, PROFILES_FILE)):
+        sys.exit('No store at ' + args.store)
+
+    if 'info' == args.command:
+        profiles = loadProfiles(args.store)
+        for profile in profiles:
+            print(profile['source'].decode() + '  ' + RACHuTS_index.formatUTC(profile['t_start']) + '  ' +
+                  RACHuTS_index.formatUTC(profile['t_end']) + '  packets: ' + str(profile['count']))
+        print(str(len(profiles)) + ' profile(s), ' + str(int(profiles['count'].sum())) + ' packets')
+        return
+
+    window = sliceWindow(args.store, args.start, args.end, args.columns)
+    print(str(len(window['UTC'])) + ' packets')
+    if len(window['UTC']):
+        print(RACHuTS_index.formatUTC(window['UTC'][0]) + ' to ' + RACHuTS_index.formatUTC(window['UTC'][-1]))
+    if args.csv is not None:
+        # UTC to the millisecond (10 significant digits would round it to whole seconds)
+        fmt = ['%.3f' if 'UTC' == name else '%.10g' for name in window]
+        np.savetxt(args.csv, np.column_stack(list(window.values())), delimiter=',', header=','.join(window),
+                   comments='', fmt=fmt)
+        print('Window in: ' + args.csv)
+
+if __name__ == "__main__":
+
+    # calling main function
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-running pipeline: sync the CCMz and decode new RACHuTS TM frames as they arrive.
+
+    python3 RACHuTS_watch.py [--interval 60] [--jobs N] [--npz]
+
+The CCMz is polled every interval seconds (see retrieve_st2_data_cfg.py for the
+flights and instruments). Each newly downloaded frame is queued and processed with
+RACHuTS_TM, so its messages and MCB CSV are written in FullTM*/Processed_Data/
+within seconds of the download.
+
+Progress is kept in the sync manifests and the processed files ledgers, so after
+a restart nothing is downloaded or processed twice. Frames that were downloaded
+but not yet processed when the pipeline stopped are picked up at startup.
+"""
+
+import argparse
+import glob
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+import retrieve_st2_data
+import RACHuTS_TM
+
+def syncLoop(frame_queue, interval, stop_event):
+    # producer: poll the CCMz and queue every new frame as soon as it is gunzipped
+    pool = retrieve_st2_data.CCMzConnectionPool()
+    try:
+        while not stop_event.is_set():
+            try:
+                retrieve_st2_data.loop_over_flights_and_instruments(pool, on_new_frame=frame_queue.put, stop_event=stop_event)
+            except Exception as err:
+                print('CCMz sync failed: ' + str(err))
+            stop_event.wait(interval)
+    finally:
+        pool.close()
+        frame_queue.put(None)
+
+def decodeLoop(frame_queue, jobs=1, npz=False):
+    # consumer: process the queued frames in batches until a None is queued
+    ledgers = dict()
+    retry_paths = []
+
+    while True:
+        file_paths = retry_paths + [frame_queue.get()]
+        retry_paths = []
+        while True:
+            try:
+                file_paths.append(frame_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        stop = None in file_paths
+        file_paths = [file_path.replace(os.sep, '/') for file_path in file_paths if file_path is not None]
+
+        # frames that fail are reported by processPaths, anything else must not stop the pipeline either
+        if file_paths:
+            try:
+                num_processed = RACHuTS_TM.processPaths(file_paths, jobs, npz, ledgers)
+                print(datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ' processed ' + str(num_processed) + ' new file(s)')
+            except Exception as err:
+                # retried with the next batch, the ledgers skip the frames that were processed
+                print(datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ' processing failed: ' + str(err))
+                retry_paths = file_paths
+
+        if stop:
+            return
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync the CCMz and decode new RACHuTS TM frames as they arrive')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between CCMz polls')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes used to decode each batch')
+    parser.add_argument('--npz', action='store_true', help='also write MCB profiles as typed NumPy columns (.npz)')
+    args = parser.parse_args()
+
+    frame_queue = queue.Queue()
+    stop_event = threading.Event()
+
+    # resume: queue the frames already on disk, the ledgers skip those already processed
+    local_frames = sorted(glob.glob(os.path.join(retrieve_st2_data.default_local_target_dir, 'FullTM_*', '*.dat')))
+    for file_path in local_frames:
+        frame_queue.put(file_path)
+
+    sync_thread = threading.Thread(target=syncLoop, args=(frame_queue, args.interval, stop_event))
+    sync_thread.start()
+
+    try:
+        decodeLoop(frame_queue, args.jobs, args.npz)
+    except KeyboardInterrupt:
+        print('Stopping, waiting for the CCMz sync to save its manifests')
+    finally:
+        # the sync thread finishes the downloads in progress and saves its manifests
+        stop_event.set()
+        sync_thread.join()
+
+if __name__ == "__main__":
+
+    # calling main function
+    main()
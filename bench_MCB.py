@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the MCB decoding pipeline on synthetic profiles (see synth_MCB.py).
+
+    python3 bench_MCB.py [--sizes 1000 100000 10000000] [--header 100000] [--json results.jsonl]
+
+For each profile size, every stage runs in its own process and reports its wall
+time, packets per second and peak RSS:
+
+    decode      readTMfile + decodeMCBData + mcbColumns
+    kinematics  st2tm.profileKinematics
+    csv         writeMCBcsv
+    load        MCB_TM.loadMCBcsv (the Plot_MCB loader)
+
+With --header N, the XML header parser is also timed over N synthetic headers,
+next to the ElementTree parser it replaced.
+
+With --json, one line per run is appended to the given file so results can be
+compared over time.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+import MCB_TM
+import st2tm
+import synth_MCB
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+STAGES = ['decode', 'kinematics', 'csv', 'load']
+
+def peakRSS():
+    # peak resident set size of this process in MB (None where unsupported)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def parseXMLTree(xmlstring):
+    # the original ElementTree header parser, kept as the reference for the header benchmark
+    root = ET.fromstring(xmlstring)
+    XMLdict = dict()
+    for child in root:
+        XMLdict[child.tag] = root.find(child.tag).text
+    return XMLdict
+
+def benchHeader(num_frames):
+    # per-frame cost of MCB_TM.parseXML and of the ElementTree parser on real-sized headers
+    headers = [synth_MCB.synthFrame(b'', msg_number=itr).split(b'<CRC>')[0].decode() for itr in range(num_frames)]
+    result = {'stage': 'header', 'frames': num_frames}
+
+    for name, parser in (('us_per_frame', MCB_TM.parseXML), ('etree_us_per_frame', parseXMLTree)):
+        start = time.perf_counter()
+        for header in headers:
+            parser(header)
+        result[name] = (time.perf_counter() - start) * 1e6 / num_frames
+
+    return result
+
+def runStage(stage, dat_name, csv_name):
+    # run one stage in this process, returns the wall time of the stage
+    base_directory, file_name = dat_name.rsplit('/',1)
+
+    # only reads the CSV, so the peak RSS is that of Plot_MCB loading a profile
+    if 'load' == stage:
+        start = time.perf_counter()
+        profile_start, columns = MCB_TM.loadMCBcsv(csv_name)
+        return time.perf_counter() - start
+
+    if 'decode' == stage:
+        start = time.perf_counter()
+        XMLstring, data = MCB_TM.readTMfile(file_name, base_directory, 7)
+        profile_start, packets = MCB_TM.decodeMCBData(data[5:-5])
+        columns = MCB_TM.mcbColumns(packets)
+        return time.perf_counter() - start
+
+    XMLstring, data = MCB_TM.readTMfile(file_name, base_directory, 7)
+    profile_start, packets = MCB_TM.decodeMCBData(data[5:-5])
+    columns = MCB_TM.mcbColumns(packets)
+
+    if 'kinematics' == stage:
+        start = time.perf_counter()
+        kinematics = st2tm.profileKinematics(columns)
+        return time.perf_counter() - start
+
+    if 'csv' == stage:
+        start = time.perf_counter()
+        MCB_TM.writeMCBcsv(csv_name, profile_start, packets, columns)
+        return time.perf_counter() - start
+
+    raise ValueError('Unknown stage: ' + stage)
+
+def benchStage(stage, num_packets, dat_name, csv_name):
+    # run a stage in a fresh process so that its peak RSS is its own
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', stage, dat_name, csv_name],
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['stage'] = stage
+    result['packets'] = num_packets
+    result['packets_per_s'] = num_packets / result['seconds'] if result['seconds'] > 0 else None
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MCB decoding on synthetic profiles')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000], help='profile sizes in packets')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='stages to run')
+    parser.add_argument('--header', type=int, default=0, metavar='N', help='also time the header parser on N headers')
+    parser.add_argument('--json', help='append the results to this JSON lines file')
+    parser.add_argument('--child', nargs=3, metavar=('STAGE', 'DAT', 'CSV'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        stage, dat_name, csv_name = args.child
+        with open(os.devnull, 'w') as devnull:
+            stdout = sys.stdout
+            sys.stdout = devnull # keep the decoder status out of the result
+            seconds = runStage(stage, dat_name, csv_name)
+            sys.stdout = stdout
+        print(json.dumps({'seconds': seconds, 'peak_rss_mb': peakRSS()}))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_directory:
+        work_directory = work_directory.replace(os.sep, '/')
+        for num_packets in args.sizes:
+            dat_name = work_directory + '/bench_' + str(num_packets) + '.dat'
+            csv_name = work_directory + '/bench_' + str(num_packets) + '.csv'
+            synth_MCB.writeSynthFile(dat_name, num_packets)
+
+            for stage in args.stages:
+                if 'load' == stage and not os.path.exists(csv_name):
+                    runStage('csv', dat_name, csv_name)
+                results.append(benchStage(stage, num_packets, dat_name, csv_name))
+                result = results[-1]
+                print('%-10s %10d packets  %8.3f s  %12.0f packets/s  peak RSS %s MB' %
+                      (stage, num_packets, result['seconds'], result['packets_per_s'] or 0,
+                       'n/a' if result['peak_rss_mb'] is None else '%.1f' % result['peak_rss_mb']))
+
+    if args.header:
+        results.append(benchHeader(args.header))
+        result = results[-1]
+        print('header     %10d frames   %8.2f us/frame  (ElementTree %.2f us/frame)' %
+              (args.header, result['us_per_frame'], result['etree_us_per_frame']))
+
+    if args.json is not None:
+        with open(args.json, 'a') as json_file:
+            json_file.write(json.dumps({'date': datetime.now().isoformat(), 'results': results}) + '\n')
+
+if __name__ == "__main__":
+
+    # calling main function
+    main()
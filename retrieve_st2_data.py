@@ -11,6 +11,11 @@ import glob
 import pysftp
 import shutil
 import gzip
+import json
+import time
+import queue
+import contextlib
+import concurrent.futures
 from zipfile import ZipFile
 #https://pysftp.readthedocs.io/en/latest/pysftp.html
 
@@ -18,15 +23,187 @@ from zipfile import ZipFile
 from retrieve_st2_data_cfg import *
 
 
+def connect_ccmz():
+    """
+    Open a new SFTP connection to the CCMz.
+    """
+    cnopts = pysftp.CnOpts()
+    cnopts.hostkeys = None
+    return pysftp.Connection(host=ccmz_url,
+                             username=ccmz_user,
+                             password=ccmz_pass,
+                             cnopts=cnopts)
+
+
+class CCMzConnectionPool(object):
+    """
+    Pool of SFTP connections shared by the download workers.
+    connect is called whenever a new connection is needed, so a local SFTP
+    server can stand in for the CCMz.
+    A connection that raised an error is closed instead of being reused.
+    """
+
+    def __init__(self, connect=connect_ccmz):
+        self.connect = connect
+        self.idle = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            sftp = self.idle.get_nowait()
+        except queue.Empty:
+            sftp = self.connect()
+
+        try:
+            yield sftp
+        except BaseException:
+            sftp.close()
+            raise
+        self.idle.put(sftp)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class TeeReader(object):
+    """
+    File-like reader that also writes everything it reads to raw_file (if not None).
+    """
+
+    def __init__(self, source, raw_file=None):
+        self.source = source
+        self.raw_file = raw_file
+
+    def read(self, size=-1):
+        chunk = self.source.read(size)
+        if self.raw_file is not None:
+            self.raw_file.write(chunk)
+        return chunk
+
+
+def stream_ccmz_file(remote_file, datafilepath, zippath=None):
+    """
+   Gunzip remote_file straight into datafilepath, keeping the raw gzip in zippath if given.
+   """
+
+    with open(datafilepath, 'wb') as f_out:
+        with (open(zippath, 'wb') if zippath is not None else contextlib.nullcontext()) as f_raw:
+            tee = TeeReader(remote_file, f_raw)
+            with gzip.GzipFile(fileobj=tee, mode='rb') as f_in:
+                shutil.copyfileobj(f_in, f_out, copy_buffer_size)
+            # the raw copy also gets anything left after the last gzip member
+            while tee.read(copy_buffer_size):
+                pass
+
+
+def download_ccmz_file(pool, ccmz_folder, ccmz_filename, local_folder,
+                       local_target_dir=default_local_target_dir,
+                       n_retries=n_download_retries,
+                       show_individual_file=True,
+                       ccmz_mtime=None):
+    """
+   Download one CCMz file and gunzip it on the fly into its day's directory.
+   The raw gzip is also kept in local_folder if keep_raw_archive is set. Both files get the CCMz mtime ccmz_mtime,
+   so that a file downloaded again is not taken for a changed frame.
+   The transfer is retried up to n_retries times.
+   Returns the path of the gunzipped file, or None if the download failed.
+   """
+
+    # find the correct day's directory
+    _, filedate, _, _, _ = ccmz_filename.rsplit('_', 4)
+    fileyear = filedate[2:4]
+    filemonth = filedate[4:6]
+    fileday = filedate[6:8]
+    newdirectory = local_target_dir + '/' + 'FullTM_' + filemonth + '-' + fileday + '-' + fileyear
+    os.makedirs(newdirectory, exist_ok=True)
+    datafilepath = newdirectory + '/' + ccmz_filename[0:-3]
+    zippath = os.path.join(local_folder, ccmz_filename) if keep_raw_archive else None
+
+    for attempt in range(1, n_retries + 1):
+        try:
+            with pool.connection() as sftp:
+                # write under temporary names so that a failed transfer is never taken as done
+                with sftp.open(ccmz_folder + '/' + ccmz_filename, 'rb') as remote_file:
+                    remote_file.prefetch()
+                    stream_ccmz_file(remote_file, datafilepath + '.part', zippath + '.part' if zippath else None)
+            os.replace(datafilepath + '.part', datafilepath)
+            if ccmz_mtime is not None:
+                os.utime(datafilepath, (ccmz_mtime, ccmz_mtime))
+            if zippath is not None:
+                os.replace(zippath + '.part', zippath)
+                if ccmz_mtime is not None:
+                    os.utime(zippath, (ccmz_mtime, ccmz_mtime))
+            break
+        except Exception as err:
+            print('\033[1m\033[91mFailed to download ' + ccmz_filename + ' (attempt ' + str(attempt) +
+                  '/' + str(n_retries) + '): ' + str(err) + '\033[0m')
+            for partpath in (datafilepath + '.part', zippath + '.part' if zippath else None):
+                if partpath is not None and os.path.exists(partpath):
+                    os.remove(partpath)
+            if attempt < n_retries:
+                time.sleep(download_retry_delay * attempt)
+    else:
+        return None
+
+    if show_individual_file == True:
+        print('Downloaded \033[92m' + ccmz_filename + '\033[0m')  # display file name
+
+    return datafilepath
+
+
+def load_manifest(local_folder):
+    """
+   Load the sync manifest of a local folder: {filename: [size, mtime]} of the CCMz files already downloaded.
+   Without a manifest, it is built from the files already in the folder (downloaded with preserve_mtime).
+   """
+
+    manifest_path = os.path.join(local_folder, manifest_filename)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+
+    manifest = dict()
+    for local_file in glob.glob(os.path.join(local_folder, '*')):
+        if not local_file.endswith('.part'):
+            local_stat = os.stat(local_file)
+            manifest[os.path.basename(local_file)] = [local_stat.st_size, int(local_stat.st_mtime)]
+
+    return manifest
+
+
+def save_manifest(local_folder, manifest):
+    """
+   Save the sync manifest of a local folder, replacing the previous one in a single step.
+   """
+
+    manifest_path = os.path.join(local_folder, manifest_filename)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
 def mirror_ccmz_folder(ccmz_folder,
                        local_target_dir=default_local_target_dir,
-                       show_individual_file=True):
+                       show_individual_file=True,
+                       pool=None,
+                       n_workers=n_download_workers,
+                       on_new_frame=None,
+                       stop_event=None):
     """
    Mirror one CCMz folder.
-   Files are stored locally in local_target_dir/ccmz_path/to/ccmz_folder/
-   Files already downloaded are not downloaded again.
+   Files are gunzipped into local_target_dir/FullTM_MM-DD-YY/ and the raw files are kept in
+   local_target_dir/ccmz_path/to/ccmz_folder/ if keep_raw_archive is set.
+   Files already downloaded are not downloaded again, unless their size or mtime changed on the CCMz.
    local_target_dir prescribes where CCMz files will be downloaded locally.
    show_individual_file controls whether the name of each downloaded file is displayed or not.
+   pool is the CCMzConnectionPool to use (a new one is opened and closed if None).
+   n_workers is the number of files downloaded in parallel.
+   on_new_frame, if given, is called with the path of each newly gunzipped file as soon as it is ready.
+   stop_event, if given and set, stops the mirroring: the files not started yet are left for the next sync.
    """
 
     print('---------------------------------')
@@ -37,83 +214,104 @@ def mirror_ccmz_folder(ccmz_folder,
     if not os.path.exists(local_folder):
         os.makedirs(local_folder)
 
+    n_downloads = 0
+    n_failed = 0
+    n_stopped = 0
+    manifest = None
+
     # Connect to CCMz
-    cnopts = pysftp.CnOpts()
-    cnopts.hostkeys = None
-    with pysftp.Connection(host=ccmz_url,
-                           username=ccmz_user,
-                           password=ccmz_pass,
-                           cnopts=cnopts) as sftp:
-        print("\033[1mConnection to CCMz succesfully established\033[0m...")
+    own_pool = pool is None
+    if own_pool:
+        pool = CCMzConnectionPool()
 
-        # Switch to the remote directory
-        try:
-            sftp.cwd(ccmz_folder)
-        except IOError:
-            print('\033[1m\033[91mNo such directory on CCMz: ' + ccmz_folder +
-                  '\033[0m')
-            return
+    try:
+        with pool.connection() as sftp:
+            print("\033[1mConnection to CCMz succesfully established\033[0m...")
 
-        # Get file list in current directory, i.e. those that have been already downloaded from CCMz
-        local_files = glob.glob(os.path.join(
-            local_folder, '*'))  # filenames with relative path
-        local_filenames = [os.path.basename(f)
-                           for f in local_files]  # filenames without
+            # Get file list from the CCMz directory with file attributes
+            try:
+                ccmz_file_list = sftp.listdir_attr(ccmz_folder)
+            except IOError:
+                print('\033[1m\033[91mNo such directory on CCMz: ' + ccmz_folder +
+                      '\033[0m')
+                return
 
-        # Get file list from the CCMz directory with file attributes
-        ccmz_file_list = sftp.listdir_attr()
+        # Load the sync manifest, i.e. the size and mtime of the files already downloaded from CCMz
+        manifest = load_manifest(local_folder)
 
         # check wether CCMz files need to be downloaded
-        n_downloads = 0
+        to_download = []
         for ccmz_file in ccmz_file_list:
             # Get rid of directories in CCMZ folder (if any)
             if ccmz_file.longname[0] == '-':
-                ccmz_filename = ccmz_file.filename
-                # Check whether the file has already been downloaded (so as to not download it again)
-                if not ccmz_filename in local_filenames:
-                    # file has to be downloaded
-                    if show_individual_file == True:
-                        print('Downloading \033[92m' + ccmz_filename + '\033[0m...')  # display file name
-                    sftp.get(ccmz_filename, os.path.join(local_folder, ccmz_filename), preserve_mtime=True)
+                # Check whether the file has already been downloaded and is unchanged (so as to not download it again)
+                if manifest.get(ccmz_file.filename) != [ccmz_file.st_size, ccmz_file.st_mtime]:
+                    to_download.append(ccmz_file)
+
+        def download(ccmz_file):
+            if stop_event is not None and stop_event.is_set():
+                return False
+            return download_ccmz_file(pool, ccmz_folder, ccmz_file.filename, local_folder, local_target_dir,
+                                      show_individual_file=show_individual_file, ccmz_mtime=ccmz_file.st_mtime)
+
+        # download the files in parallel, each file is retried on its own
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(download, ccmz_file): ccmz_file for ccmz_file in to_download}
+            for future in concurrent.futures.as_completed(futures):
+                datafilepath = future.result()
+                if datafilepath is False:
+                    n_stopped = n_stopped + 1
+                elif datafilepath is not None:
+                    if on_new_frame is not None:
+                        on_new_frame(datafilepath)
+                    ccmz_file = futures[future]
+                    manifest[ccmz_file.filename] = [ccmz_file.st_size, ccmz_file.st_mtime]
                     n_downloads = n_downloads + 1
+                    # saved after each download, so a stop never loses a file that was already fetched
+                    save_manifest(local_folder, manifest)
+                else:
+                    n_failed = n_failed + 1
+    finally:
+        if own_pool:
+            pool.close()
+        if manifest is not None:
+            save_manifest(local_folder, manifest)
+
+    # and print some statistics
+    if n_downloads == 0 and n_failed == 0 and n_stopped == 0:
+        print('\nYour local repository \033[92m' + local_folder +
+              '\033[0m looks\033[1m up do date\033[0m')
+    else:
+        print('\n\033[1m' + str(n_downloads) +
+              '\033[0m file(s) downloaded in \033[92m' + local_folder +
+              '\033[0m')
+    if n_failed != 0:
+        print('\033[1m\033[91m' + str(n_failed) + ' file(s) failed to download\033[0m')
+    if n_stopped != 0:
+        print(str(n_stopped) + ' file(s) left for the next sync')
+
 
-                    # move the file to the correct day's directory
-                    zippath = os.path.join(local_folder, ccmz_filename)
-                    print(zippath)
-                    _, filedate, _, _, _ = ccmz_filename.rsplit('_', 4)
-                    fileyear = filedate[2:4]
-                    filemonth = filedate[4:6]
-                    fileday = filedate[6:8]
-                    newdirectory = default_local_target_dir + '/' + 'FullTM_' + filemonth + '-' + fileday + '-' + fileyear
-                    if not os.path.exists(newdirectory + '/'):
-                        os.mkdir(newdirectory)
-                    datafilepath = newdirectory + '/' + ccmz_filename
-                    shutil.copyfile(zippath, datafilepath)
-                    with gzip.open(datafilepath, 'rb') as f_in:
-                        with open(datafilepath[0:-3], 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                    os.remove(datafilepath)  # delete the gzip
-
-        # and print some statistics
-        if n_downloads == 0:
-            print('\nYour local repository \033[92m' + local_folder +
-                  '\033[0m looks\033[1m up do date\033[0m')
-        else:
-            print('\n\033[1m' + str(n_downloads) +
-                  '\033[0m file(s) downloaded in \033[92m' + local_folder +
-                  '\033[0m')
-
-
-def loop_over_flights_and_instruments():
+def loop_over_flights_and_instruments(pool=None, on_new_frame=None, stop_event=None):
     """
     Get all data from CCMz for the input list of flights/instruments
+    pool, on_new_frame and stop_event are passed on to mirror_ccmz_folder
     """
-    for flight in my_flights:
-        for instrument in my_instruments:
-            ccmz_folder = flight + '/' + instrument + '/' + flight_or_test + '/' + tm_or_tc + '/' + raw_or_processed
-            #ccmz_folder=os.path.join(flight,instrument,flight_or_test,tm_or_tc,raw_or_processed)
-            #mirror_ccmz_folder(ccmz_folder)
-            mirror_ccmz_folder(ccmz_folder, show_individual_file=False)
+    own_pool = pool is None
+    if own_pool:
+        pool = CCMzConnectionPool()
+    try:
+        for flight in my_flights:
+            for instrument in my_instruments:
+                ccmz_folder = flight + '/' + instrument + '/' + flight_or_test + '/' + tm_or_tc + '/' + raw_or_processed
+                #ccmz_folder=os.path.join(flight,instrument,flight_or_test,tm_or_tc,raw_or_processed)
+                #mirror_ccmz_folder(ccmz_folder)
+                if stop_event is not None and stop_event.is_set():
+                    return
+                mirror_ccmz_folder(ccmz_folder, show_individual_file=False, pool=pool, on_new_frame=on_new_frame,
+                                   stop_event=stop_event)
+    finally:
+        if own_pool:
+            pool.close()
 
 
 if __name__ == '__main__':
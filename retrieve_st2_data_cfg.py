@@ -8,6 +8,15 @@ ccmz_url="sshstr2.ipsl.polytechnique.fr" # CCMz URL from where to download data
 ccmz_user="astclair" # Your login on the CCMz
 ccmz_pass="j;zk8t6u" # Your password on the CCMz
 
+n_download_workers=4 # number of files downloaded from the CCMz in parallel
+n_download_retries=3 # attempts per file before giving up on it
+download_retry_delay=2 # seconds, multiplied by the attempt number
+
+manifest_filename='ccmz_manifest.json' # size and mtime of the files downloaded in each local folder
+
+keep_raw_archive=True # also keep the raw .gz files in the local mirror folder
+copy_buffer_size=1024*1024 # bytes per read when decompressing a download
+
 # ID of flights in which I'm interested in
 my_flights=['ST2_C0_03_TTL3'] # Adapt according to your needs
 
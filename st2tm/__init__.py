@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Decoding library for Strateole-2 TM frames, independent of where the frames are stored.
+
+A frame is read from a file or built from bytes already in memory (for example
+straight from an SFTP stream), then handed to the decoder registered for its
+message type:
+
+    import st2tm
+
+    frame = st2tm.readFrame('FullTM_10-01-21/TM_2.dat')    # or st2tm.frameFromBytes(data)
+    message_type, result = st2tm.decodeFrame(frame)
+    if 'MCB' == message_type:
+        print(result.profile_start, result.columns['Reel Torque Max'].max())
+
+Nothing is printed or written to disk; MCB_TM.py and RACHuTS_TM.py build the
+CSVs and messages on top of this package.
+"""
+
+from st2tm.header import TMHeader, parseXML
+from st2tm.frame import TMFrame, mapFile, readHeader, readData, readFrame, frameFromBytes
+from st2tm.registry import DECODERS, registerDecoder, messageType, decodeFrame, decodeFrames
+from st2tm.mcb import MCBProfile, decodeMCB, mcbColumns
+from st2tm.kinematics import KINEMATICS_COLUMNS, unwrapElapsed, reelKinematics, profileKinematics
+from st2tm.rotating import ROTATING_METHODS, densifyRotating
+from st2tm.alarms import evaluateAlarms
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Threshold alarms evaluated over whole decoded MCB profiles.
+
+A rule is (alarm name, column, '>' or '<', limit, minimum packets). Each run of
+consecutive packets out of limit that lasts at least the minimum number of
+packets is an event, with its start and end elapsed times and its peak value.
+"""
+
+import numpy as np
+from st2tm.rotating import densifyRotating
+
+ALARM_OPERATORS = {'>': (np.greater, np.fmax), '<': (np.less, np.fmin)}
+
+def outOfLimitRuns(out_of_limit):
+    # (start, end) packet indices of the runs of True, end excluded
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], out_of_limit, [False])).view(np.int8)))
+    return edges[::2], edges[1::2]
+
+def evaluateAlarms(columns, rules, rotating='ffill'):
+    # returns the events of every rule, in rule then time order
+    if rotating not in ('ffill', 'interp'):
+        raise ValueError('Alarms need the rotating TM at every packet (ffill or interp), not ' + str(rotating))
+
+    dense = densifyRotating(columns, rotating)
+    times = dense['Elapsed Time']
+
+    events = []
+    for name, column, operator, limit, min_packets in rules:
+        if operator not in ALARM_OPERATORS:
+            raise ValueError('Unknown operator for alarm ' + name + ': ' + str(operator))
+        compare, peak_of = ALARM_OPERATORS[operator]
+
+        values = np.asarray(dense[column] if column in dense else columns[column], dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            starts, ends = outOfLimitRuns(compare(values, limit))
+
+        keep = ends - starts >= max(min_packets, 1)
+        starts, ends = starts[keep], ends[keep]
+        if 0 == len(starts):
+            continue
+
+        # peak of each run in one pass, the NaN sentinel lets the last run end the array
+        bounds = np.column_stack((starts, ends)).ravel()
+        peaks = peak_of.reduceat(np.append(values, np.nan), bounds)[::2]
+
+        for start, end, peak, packets in zip(times[starts].tolist(), times[ends-1].tolist(), peaks.tolist(),
+                                             (ends - starts).tolist()):
+            events.append({'alarm': name, 'column': column, 'limit': limit, 'start': start, 'end': end,
+                           'peak': peak, 'packets': packets})
+
+    return events
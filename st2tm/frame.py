@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+TM frames read from files or built from bytes in memory.
+
+A frame file holds the XML header lines, a <CRC> line, then START + payload +
+2-byte CRC + END. Frames read from files only map the data once it is used, so
+status-only frames cost a single small read.
+"""
+
+import mmap
+import os
+from st2tm import stats
+from st2tm.header import parseXML
+
+# Number of lines in the XML header of a TM frame (the <CRC> line follows)
+HEADER_LINES = 7
+
+# Bytes read at a time while looking for the end of the XML header
+HEADER_READ_SIZE = 1024
+
+class TMFrame:
+    # a TM frame: the parsed header and the data after the <CRC> line
+    __slots__ = ('header', 'source', '_data', '_data_start')
+
+    def __init__(self, header, data=None, source=None, data_start=0):
+        # without data, the data is mapped from the source file when first used
+        self.header = header
+        self.source = source
+        self._data = data
+        self._data_start = data_start
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = readData(self.source, self._data_start)
+        return self._data
+
+    @property
+    def payload(self):
+        # the data without START, the CRC and END
+        return self.data[5:-5]
+
+    def __repr__(self):
+        return 'TMFrame(' + repr(self.header) + ', source=' + repr(self.source) + ')'
+
+def mapFile(file_path):
+    # map the file read-only, the returned view keeps the map open until it is released
+    with open(file_path, 'rb') as TM_file:
+        if 0 == os.fstat(TM_file.fileno()).st_size:
+            return memoryview(b'')
+        TM_map = mmap.mmap(TM_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return memoryview(TM_map)
+
+def splitHeader(head, lines=HEADER_LINES, complete=True):
+    # offsets of the end of the XML header and of the data in the first bytes of a frame
+    # returns None if more bytes are needed, complete means that head is the whole frame
+    header_end = None
+    data_start = 0
+
+    # the XML header is followed by one more line before the data
+    for x in range(lines + 1):
+        line_end = head.find(b'\n', data_start)
+        if -1 == line_end:
+            if not complete:
+                return None
+            if x < lines:
+                raise ValueError('Incomplete XML header')
+            return header_end, len(head)
+        if x == lines - 1:
+            header_end = line_end + 1
+        data_start = line_end + 1
+
+    return header_end, data_start
+
+def readHeader(file_path, lines=HEADER_LINES):
+    # read only as much of the file as the XML header needs, returns the header and the data offset
+    with stats.stage('read'):
+        with open(file_path, 'rb') as TM_file:
+            head = b''
+            offsets = None
+            while offsets is None:
+                chunk = TM_file.read(HEADER_READ_SIZE)
+                head += chunk
+                try:
+                    offsets = splitHeader(head, lines, len(chunk) < HEADER_READ_SIZE)
+                except ValueError:
+                    raise ValueError('Incomplete XML header in ' + file_path)
+
+    stats.count('bytes_read', len(head))
+
+    header_end, data_start = offsets
+    return head[:header_end].decode(), data_start
+
+def readData(file_path, data_start=0):
+    # the data is a zero-copy slice of the mapped file
+    with stats.stage('read'):
+        TM_data = mapFile(file_path)
+
+    stats.count('bytes_read', max(len(TM_data) - data_start, 0))
+
+    return TM_data[data_start:]
+
+def readFrame(file_path, lines=HEADER_LINES):
+    # frame with its header parsed, the data is only mapped when used
+    XMLstring, data_start = readHeader(file_path, lines)
+    with stats.stage('xml'):
+        header = parseXML(XMLstring)
+
+    return TMFrame(header, source=file_path, data_start=data_start)
+
+def frameFromBytes(data, lines=HEADER_LINES, source=None):
+    # frame from a whole frame in memory (bytes, bytearray, memoryview...), the data is not copied
+    view = memoryview(data).cast('B')
+    head_size = HEADER_READ_SIZE
+    offsets = None
+    while offsets is None:
+        offsets = splitHeader(bytes(view[:head_size]), lines, head_size >= len(view))
+        head_size *= 2
+
+    header_end, data_start = offsets
+    with stats.stage('xml'):
+        header = parseXML(bytes(view[:header_end]).decode())
+
+    return TMFrame(header, view[data_start:], source)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Parser for the XML header at the start of every Strateole-2 TM frame.
+"""
+
+import re
+from xml.sax.saxutils import unescape
+
+# Strateole-2 TM XML header tags, the second and third instrument states are optional
+TM_HEADER_TAGS = ('Msg', 'Inst', 'Length', 'StateFlag1', 'StateMess1', 'StateFlag2', 'StateMess2', 'StateFlag3', 'StateMess3')
+TM_HEADER_TAG_SET = frozenset(TM_HEADER_TAGS)
+TM_HEADER_REQUIRED = frozenset(TM_HEADER_TAGS[:5])
+
+# A <TM> element holding only <Tag>text</Tag> elements, and each of those elements
+TM_HEADER_RE = re.compile(r'\s*<TM>\s*((?:<(\w+)>[^<]*</\2>\s*)*)</TM>\s*\Z')
+TM_ELEMENT_RE = re.compile(r'<(\w+)>([^<]*)</\1>')
+
+# Entities unescaped in the header text, on top of &amp; &lt; &gt;
+XML_ENTITIES = {'&quot;': '"', '&apos;': "'"}
+
+class TMHeader:
+    # fields of a TM XML header, also indexable by tag like the ElementTree dict it replaces
+    __slots__ = TM_HEADER_TAGS
+
+    def __init__(self, fields):
+        get = fields.get
+        self.Msg = get('Msg')
+        self.Inst = get('Inst')
+        self.Length = get('Length')
+        self.StateFlag1 = get('StateFlag1')
+        self.StateMess1 = get('StateMess1')
+        self.StateFlag2 = get('StateFlag2')
+        self.StateMess2 = get('StateMess2')
+        self.StateFlag3 = get('StateFlag3')
+        self.StateMess3 = get('StateMess3')
+
+    def __getitem__(self, tag):
+        value = getattr(self, tag) if tag in TM_HEADER_TAG_SET else None
+        if value is None:
+            raise KeyError(tag)
+        return value
+
+    def __contains__(self, tag):
+        return tag in TM_HEADER_TAG_SET and getattr(self, tag) is not None
+
+    def get(self, tag, default=None):
+        value = getattr(self, tag) if tag in TM_HEADER_TAG_SET else None
+        return default if value is None else value
+
+    def __repr__(self):
+        return 'TMHeader(' + ', '.join(tag + '=' + repr(getattr(self, tag)) for tag in TM_HEADER_TAGS
+                                       if getattr(self, tag) is not None) + ')'
+
+def headerError(xmlstring):
+    # describe why a TM header did not match TM_HEADER_RE
+    outer = re.match(r'\s*<TM>(.*)</TM>\s*\Z', xmlstring, re.DOTALL)
+    if outer is None:
+        return 'TM header is not a <TM> element: ' + repr(xmlstring[:80])
+
+    body = outer.group(1)
+    pos = 0
+    while body[pos:].strip():
+        element = re.match(r'\s*<(\w+)>([^<]*)</(\w+)>', body[pos:])
+        if element is None:
+            return 'Malformed TM header element: ' + repr(body[pos:].strip()[:80])
+        if element.group(1) != element.group(3):
+            return 'Mismatched TM header tags: <' + element.group(1) + '> and </' + element.group(3) + '>'
+        pos += element.end()
+
+    return 'Malformed TM header: ' + repr(xmlstring[:80])
+
+def parseXML(xmlstring):
+    # one regex pass checks the structure, a second collects the elements, raises ValueError if malformed
+    outer = TM_HEADER_RE.match(xmlstring)
+    if outer is None:
+        raise ValueError(headerError(xmlstring))
+
+    elements = TM_ELEMENT_RE.findall(outer.group(1))
+    fields = dict(elements)
+
+    if len(fields) != len(elements):
+        tags = [tag for tag, text in elements]
+        raise ValueError('Repeated TM header tag: <' + next(tag for tag in tags if tags.count(tag) > 1) + '>')
+    if not fields.keys() <= TM_HEADER_TAG_SET:
+        raise ValueError('Unknown TM header tag: <' + next(tag for tag in fields if tag not in TM_HEADER_TAG_SET) + '>')
+    if not fields.keys() >= TM_HEADER_REQUIRED:
+        raise ValueError('TM header is missing <' + next(tag for tag in TM_HEADER_TAGS if tag not in fields) + '>')
+    if not (fields['Msg'].strip().isdigit() and fields['Length'].strip().isdigit()):
+        raise ValueError('TM header <Msg> and <Length> must be numbers: ' + repr((fields['Msg'], fields['Length'])))
+
+    if '&' in outer.group(1):
+        for tag, text in elements:
+            fields[tag] = unescape(text, XML_ENTITIES)
+
+    return TMHeader(fields)
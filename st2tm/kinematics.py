@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Reel kinematics derived from a decoded MCB profile.
+
+The positions are averaged over packets sharing an elapsed time, smoothed with a
+centred moving average, then differentiated against the elapsed time (unwrapped
+across the 16-bit counter wraps), so that repeated or wrapped time stamps never
+divide by zero. Everything is vectorized over the whole profile.
+"""
+
+import numpy as np
+
+# Period of the elapsed time counter (16 bits of 0.1 s)
+ELAPSED_WRAP = 6553.6
+
+# Default moving-average window, in packets
+SMOOTHING_WINDOW = 9
+
+# Columns added to a profile, in position units per minute, per minute per second, and
+# position units (or cable length if a reel circumference is given)
+KINEMATICS_COLUMNS = ['Reel Speed', 'Reel Acceleration', 'LW Speed', 'Cable Payout']
+
+def unwrapElapsed(elapsed):
+    # elapsed times continuing across the counter wraps (a large backward step is a wrap)
+    is_wrap = np.diff(elapsed) < -ELAPSED_WRAP / 2
+    if not is_wrap.any():
+        return elapsed
+
+    wraps = np.zeros(len(elapsed))
+    np.cumsum(is_wrap, out=wraps[1:])
+    return elapsed + wraps * ELAPSED_WRAP
+
+def movingAverage(values, window=SMOOTHING_WINDOW):
+    # centred moving average over window samples (rounded up to odd), narrowed symmetrically at the ends
+    num_values = len(values)
+    half = min(int(window) // 2, (num_values - 1) // 2)
+    if half < 1:
+        return values.astype(np.float64)
+
+    sums = np.zeros(num_values + 1)
+    np.cumsum(values, out=sums[1:])
+
+    width = 2 * half + 1
+    averages = np.empty(num_values)
+    averages[half:num_values-half] = (sums[width:] - sums[:-width]) / width
+
+    # the windows near the ends keep the sample at their centre (half-width itr)
+    for itr in range(half):
+        averages[itr] = sums[2 * itr + 1] / (2 * itr + 1)
+        averages[num_values-1-itr] = (sums[num_values] - sums[num_values-1-2*itr]) / (2 * itr + 1)
+
+    return averages
+
+def derivative(values, times):
+    # central differences, one-sided at the ends (times must be distinct)
+    slopes = np.empty(len(values))
+    slopes[1:-1] = (values[2:] - values[:-2]) / (times[2:] - times[:-2])
+    slopes[0] = (values[1] - values[0]) / (times[1] - times[0])
+    slopes[-1] = (values[-1] - values[-2]) / (times[-1] - times[-2])
+    return slopes
+
+def reelKinematics(elapsed, reel_pos, lw_pos, window=SMOOTHING_WINDOW, circumference=None):
+    # one array per KINEMATICS_COLUMNS name, NaN if there are fewer than two distinct times
+    num_packets = len(elapsed)
+    kinematics = {name: np.full(num_packets, np.nan) for name in KINEMATICS_COLUMNS}
+
+    time = unwrapElapsed(np.asarray(elapsed, dtype=np.float64))
+
+    if num_packets < 2:
+        return kinematics
+
+    # packets sharing a time stamp, adjacent or not, are averaged into one point, in time order
+    group = None
+    if np.all(np.diff(time) > 0):
+        times = time
+        reel = np.asarray(reel_pos, dtype=np.float64)
+        lw = np.asarray(lw_pos, dtype=np.float64)
+    else:
+        times, group = np.unique(time, return_inverse=True)
+        if len(times) < 2:
+            return kinematics
+        counts = np.bincount(group)
+        reel = np.bincount(group, weights=reel_pos) / counts
+        lw = np.bincount(group, weights=lw_pos) / counts
+
+    reel_speed = derivative(movingAverage(reel, window), times) * 60
+    kinematics['Reel Speed'] = reel_speed
+    kinematics['Reel Acceleration'] = derivative(movingAverage(reel_speed, window), times)
+    kinematics['LW Speed'] = derivative(movingAverage(lw, window), times) * 60
+    kinematics['Cable Payout'] = (reel - reel[0]) * (1.0 if circumference is None else circumference)
+
+    # back to one value per packet
+    if group is not None:
+        for name in KINEMATICS_COLUMNS:
+            kinematics[name] = kinematics[name][group]
+
+    return kinematics
+
+def profileKinematics(columns, window=SMOOTHING_WINDOW, circumference=None):
+    # kinematics of a profile from its decoded columns (see st2tm.mcb.mcbColumns)
+    return reelKinematics(columns['Elapsed Time'], columns['Reel Position'], columns['LW Position'],
+                          window, circumference)
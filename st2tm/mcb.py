@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Decoder for the RACHuTS MCB profiles sent at the end of each profile and when docking.
+
+The payload is the 4-byte profile start time (UTC seconds) followed by 32-byte
+packets. decodeMCB returns the packets and their columns in physical units. Packets
+with a bad sync byte are dropped, and payloads that are off the 32-byte grid (missing
+or extra bytes) are rescanned for the intact packets.
+"""
+
+import struct
+import numpy as np
+from st2tm import stats
+from st2tm.registry import registerDecoder
+
+# ADC -> Current conversion constants
+SENSE_CURR_SLOPE = 11700
+MAX_ADC_READ = 4095
+VREF = 3.196
+I_OFFSET = 0.00018
+PULLDOWN_RESISTOR = 2000
+SUPPLY_VOLT_DIV = 0.102
+
+# MCB profile packet layout (32 bytes, big-endian), equivalent to '>BHBHHHHHHHHHHff'
+MCB_PACKET_DTYPE = np.dtype([('sync', 'u1'), ('elapsed', '>u2'), ('enum', 'u1'), ('rot_avg', '>u2'), ('rot_max', '>u2'),
+                             ('reel_torque_avg', '>u2'), ('reel_torque_max', '>u2'), ('lw_torque_avg', '>u2'),
+                             ('lw_torque_max', '>u2'), ('reel_curr_avg', '>u2'), ('reel_curr_max', '>u2'),
+                             ('lw_curr_avg', '>u2'), ('lw_curr_max', '>u2'), ('reel_pos', '>f4'), ('lw_pos', '>f4')])
+
+# Columns for each rotating TM enum value
+ROTATING_CHANNELS = [('Reel Temp Avg', 'Reel Temp Max'), ('LW Temp Avg', 'LW Temp Max'), ('MC1 Temp Avg', 'MC1 Temp Max'),
+                     ('MC2 Temp Avg', 'MC2 Temp Max'), ('Brake Curr Avg', 'Brake Curr Max'),
+                     ('Supply Volt Avg', 'Supply Volt Max')]
+
+# Column names of a decoded profile, in CSV order
+MCB_COLUMNS = ['Elapsed Time', 'Reel Torque Avg', 'Reel Torque Max', 'LW Torque Avg', 'LW Torque Max', 'Reel Curr Avg',
+               'Reel Curr Max', 'LW Curr Avg', 'LW Curr Max', 'Differential Reel Speed', 'Reel Position',
+               'LW Position', 'Enum', 'Reel Temp Avg', 'Reel Temp Max', 'LW Temp Avg', 'LW Temp Max', 'MC1 Temp Avg',
+               'MC1 Temp Max', 'MC2 Temp Avg', 'MC2 Temp Max', 'Brake Curr Avg', 'Brake Curr Max', 'Supply Volt Avg',
+               'Supply Volt Max']
+
+class MCBProfile:
+    # a decoded MCB payload, bad_sync holds the packet numbers with a bad sync byte and
+    # gaps the (offset, length) of the bytes skipped when the payload had to be rescanned
+    __slots__ = ('profile_start', 'packets', 'columns', 'data_length', 'bad_sync', 'gaps')
+
+    def __init__(self, profile_start, packets, columns, data_length, bad_sync, gaps):
+        self.profile_start = profile_start
+        self.packets = packets
+        self.columns = columns
+        self.data_length = data_length
+        self.bad_sync = bad_sync
+        self.gaps = gaps
+
+    @property
+    def valid_length(self):
+        return 0 == (self.data_length - 4) % 32
+
+def scanMCBPackets(data):
+    # find the intact packets in a payload with dropped, extra or corrupted bytes
+    # returns the packets and the (offset, length) of each stretch of bytes that was skipped
+    buf = np.frombuffer(data, dtype=np.uint8)
+    data_length = len(buf)
+
+    # candidates: a sync byte with a valid rotating TM enum (a truncated last packet still counts as a start)
+    starts = np.flatnonzero(buf[4:data_length] == 0xA5) + 4
+    starts = starts[(starts + 3 >= data_length) | (buf[np.minimum(starts + 3, data_length - 1)] <= 5)]
+
+    # a candidate is a full packet only when another one (or the payload end) starts exactly 32 bytes later:
+    # a packet with extra or missing bytes is skipped whole, rather than cut to 32 bytes of garbage
+    is_start = np.zeros(data_length + 33, dtype=bool)
+    is_start[starts] = True
+    is_start[data_length] = True
+    starts = starts[is_start[starts + 32]]
+
+    # resolve overlapping candidates, keeping the earlier one of each overlapping pair
+    while True:
+        overlaps = np.flatnonzero(np.diff(starts) < 32) + 1
+        if 0 == len(overlaps):
+            break
+        starts = np.delete(starts, overlaps[~np.isin(overlaps - 1, overlaps)])
+
+    # drop isolated out-of-order elapsed times (a step followed by both neighbours is a counter wrap)
+    if len(starts) > 2:
+        elapsed = (buf[starts + 1].astype(np.int32) << 8) | buf[starts + 2]
+        before = np.r_[elapsed[0], elapsed[:-1]]
+        after = np.r_[elapsed[1:], elapsed[-1]]
+        starts = starts[~(((elapsed < before) | (elapsed > after)) & (before <= after))]
+
+    # report the bytes not covered by a packet
+    gap_starts = np.r_[4, starts + 32]
+    gap_lengths = np.r_[starts, data_length] - gap_starts
+    gaps = list(zip(gap_starts[gap_lengths > 0].tolist(), gap_lengths[gap_lengths > 0].tolist()))
+
+    packets = buf[starts[:,np.newaxis] + np.arange(32)].view(MCB_PACKET_DTYPE).reshape(-1)
+
+    return packets, gaps
+
+def decodeMCB(data, columns=True):
+    # returns an MCBProfile, None if the payload is too short for the profile start time
+    data_length = len(data)
+
+    if (data_length < 4):
+        stats.count('invalid_length')
+        return None
+
+    # read the header (time in seconds since standard epoch)
+    profile_start = struct.unpack_from('>I',data,0)[0]
+
+    bad_sync = np.zeros(0, dtype=np.intp)
+    gaps = None
+
+    # Make sure we have a valid number of packets in the data
+    if ((data_length - 4) % 32 != 0):
+        stats.count('invalid_length')
+        packets = None
+    else:
+        # view all of the packets at once, no per-packet unpacking
+        packets = np.frombuffer(data, dtype=MCB_PACKET_DTYPE, count=(data_length-4) // 32, offset=4)
+
+        # make sure the sync bytes are valid, only the packets with a bad one are dropped
+        is_bad = packets['sync'] != 0xA5
+        bad_sync = np.flatnonzero(is_bad)
+        if len(bad_sync):
+            packets = packets[~is_bad]
+
+            # bytes both dropped and inserted keep the length but shift the packets between them
+            # off the grid, so the rescanned packets are used when there are more of them
+            scanned_packets, scanned_gaps = scanMCBPackets(data)
+            if len(scanned_packets) > len(packets):
+                packets, gaps = scanned_packets, scanned_gaps
+                bad_sync = np.zeros(0, dtype=np.intp)
+        stats.count('bad_sync', len(bad_sync))
+
+    # the packets are not on a 32-byte grid, scan for the sync bytes to recover the intact packets
+    if packets is None:
+        packets, gaps = scanMCBPackets(data)
+    if gaps is not None:
+        stats.count('resync_gaps', len(gaps))
+        stats.count('resync_bytes_skipped', sum(length for offset, length in gaps))
+
+    stats.count('packets_decoded', len(packets))
+
+    return MCBProfile(profile_start, packets, mcbColumns(packets) if columns else None, data_length, bad_sync, gaps)
+
+def torqueOrTemp(raw):
+    return np.where(raw == 0, 0.0, (raw.astype(np.int64) - 30000)/10.0)
+
+def senseCurrent(raw):
+    return SENSE_CURR_SLOPE * ((VREF/PULLDOWN_RESISTOR) * (raw/MAX_ADC_READ) - I_OFFSET)
+
+def supplyVoltage(raw):
+    return VREF * (raw/MAX_ADC_READ) / SUPPLY_VOLT_DIV
+
+def mcbColumns(packets):
+    # convert the packets to physical units, one array per column (NaN where absent)
+    columns = dict()
+    num_packets = len(packets)
+
+    # get the regular TM
+    columns['Elapsed Time'] = packets['elapsed']/10.0
+    columns['Reel Torque Avg'] = torqueOrTemp(packets['reel_torque_avg'])
+    columns['Reel Torque Max'] = torqueOrTemp(packets['reel_torque_max'])
+    columns['LW Torque Avg'] = torqueOrTemp(packets['lw_torque_avg'])
+    columns['LW Torque Max'] = torqueOrTemp(packets['lw_torque_max'])
+    columns['Reel Curr Avg'] = senseCurrent(packets['reel_curr_avg'])
+    columns['Reel Curr Max'] = senseCurrent(packets['reel_curr_max'])
+    columns['LW Curr Avg'] = senseCurrent(packets['lw_curr_avg'])
+    columns['LW Curr Max'] = senseCurrent(packets['lw_curr_max'])
+    columns['Reel Position'] = packets['reel_pos'].astype(np.float64)
+    columns['LW Position'] = packets['lw_pos'].astype(np.float64)
+
+    reel_speed = np.full(num_packets, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reel_speed[1:] = np.diff(columns['Reel Position']) / np.diff(columns['Elapsed Time']) * 60
+    reel_speed[np.isinf(reel_speed)] = np.nan # repeated elapsed time, no speed
+    columns['Differential Reel Speed'] = reel_speed
+
+    # get the rotating TM
+    enum = packets['enum']
+    columns['Enum'] = enum
+    for enum_value, (avg_name, max_name) in enumerate(ROTATING_CHANNELS):
+        indices = enum == enum_value
+        avg_values = np.full(num_packets, np.nan)
+        max_values = np.full(num_packets, np.nan)
+        if (4 == enum_value): # brake curr
+            avg_values[indices] = packets['rot_avg'][indices]
+            max_values[indices] = packets['rot_max'][indices]
+        elif (5 == enum_value): # supply voltage
+            avg_values[indices] = supplyVoltage(packets['rot_avg'][indices])
+            max_values[indices] = supplyVoltage(packets['rot_max'][indices])
+        else: # temperatures
+            avg_values[indices] = torqueOrTemp(packets['rot_avg'][indices])
+            max_values[indices] = torqueOrTemp(packets['rot_max'][indices])
+        columns[avg_name] = avg_values
+        columns[max_name] = max_values
+
+    return columns
+
+def isMCBProfile(header):
+    return 'Finished' in header['StateMess1'] or 'dock condition' in header['StateMess1']
+
+@registerDecoder('MCB', isMCBProfile)
+def decodeMCBFrame(frame):
+    return decodeMCB(frame.payload)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the decoders for each TM message type.
+
+A decoder is registered with the message type it produces and a test on the
+frame header, and is then used for every frame whose header passes the test:
+
+    @registerDecoder('MCB', isMCBProfile)
+    def decodeMCBFrame(frame):
+        ...
+"""
+
+# (message type, match(header), decode(frame)), tested in registration order
+DECODERS = []
+
+def registerDecoder(message_type, match):
+    def register(decode):
+        DECODERS.append((message_type, match, decode))
+        return decode
+    return register
+
+def findDecoder(header):
+    # (message type, decode) of the first decoder matching the header, (None, None) if none
+    for message_type, match, decode in DECODERS:
+        if match(header):
+            return message_type, decode
+
+    return None, None
+
+def messageType(header):
+    return findDecoder(header)[0]
+
+def decodeFrame(frame):
+    # returns the message type and the decoder result, (None, None) if no decoder matches
+    message_type, decode = findDecoder(frame.header)
+    if decode is None:
+        return None, None
+
+    return message_type, decode(frame)
+
+def decodeFrames(frames):
+    # decode a batch of frames, yields (frame, message type, result) in order
+    for frame in frames:
+        message_type, result = decodeFrame(frame)
+        yield frame, message_type, result
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Dense series for the rotating MCB telemetry channels.
+
+Each MCB packet carries one of the six rotating channels (temperatures, brake
+current, supply voltage) selected by its enum, so every channel column is NaN in
+five of six packets. densifyRotating turns them into dense, time-aligned series:
+
+    ffill     the last value received, at every packet (NaN before the first one)
+    interp    linear interpolation at every packet (NaN outside the received range)
+    resample  linear interpolation on a regular time grid shared by all channels
+"""
+
+import numpy as np
+from st2tm.mcb import ROTATING_CHANNELS
+from st2tm.kinematics import unwrapElapsed
+
+ROTATING_METHODS = ('ffill', 'interp', 'resample')
+
+def densifyRotating(columns, method='ffill', period=None):
+    # returns 'Elapsed Time' (continued across counter wraps) and a dense array per rotating column
+    # period is the resample grid step in seconds, by default one full cycle of the channels
+    if method not in ROTATING_METHODS:
+        raise ValueError('Unknown rotating TM method: ' + str(method))
+
+    enum = np.asarray(columns['Enum'])
+    times = unwrapElapsed(np.asarray(columns['Elapsed Time'], dtype=np.float64))
+    num_packets = len(enum)
+
+    # one pass over the enum: a stable sort groups the packets of each channel, in time order
+    order = np.argsort(enum, kind='stable')
+    bounds = np.searchsorted(enum[order], np.arange(len(ROTATING_CHANNELS) + 1))
+
+    target_times = times
+    if 'resample' == method and num_packets:
+        if period is None:
+            # repeated times are not a packet interval, and 1 s stands in when there is no interval at all
+            steps = np.diff(times)
+            steps = steps[steps > 0]
+            period = len(ROTATING_CHANNELS) * (np.median(steps) if len(steps) else 1.0)
+        elif not period > 0:
+            raise ValueError('Resample period must be positive: ' + str(period))
+        target_times = times[0] + period * np.arange(int((times[-1] - times[0]) // period) + 1)
+
+    dense = {'Elapsed Time': target_times}
+    for enum_value, channel in enumerate(ROTATING_CHANNELS):
+        indices = order[bounds[enum_value]:bounds[enum_value+1]]
+
+        if 'ffill' == method:
+            # index of the latest packet of the channel at or before each packet
+            latest = np.full(num_packets, -1)
+            latest[indices] = indices
+            np.maximum.accumulate(latest, out=latest)
+
+        for name in channel:
+            values = np.asarray(columns[name], dtype=np.float64)
+            if 0 == len(indices):
+                dense[name] = np.full(len(target_times), np.nan)
+            elif 'ffill' == method:
+                dense[name] = values[latest]
+                dense[name][:indices[0]] = np.nan # nothing received yet
+            else:
+                dense[name] = np.interp(target_times, times[indices], values[indices], left=np.nan, right=np.nan)
+
+    return dense
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight timing and counters for the TM processing pipeline.
+
+Collection is off unless enabled (python3 RACHuTS_TM.py --stats stats.json FullTM*/*.dat).
+Each process keeps a record for the file it is processing:
+
+    beginFile(file_path)
+    with stage('decode'):
+        ...
+    count('bad_sync', 3)
+    record = endFile()
+
+The per-file records are then combined into one JSON summary per batch by writeSummary.
+"""
+
+import contextlib
+import json
+import time
+
+# Collection switch, set per process by enable()
+ENABLED = False
+
+# Record of the file being processed in this process
+current = None
+
+def enable(flag=True):
+    global ENABLED
+    ENABLED = flag
+
+def beginFile(file_path):
+    global current
+    if ENABLED:
+        current = {'file': file_path, 'start': time.perf_counter(), 'stages': dict(), 'counts': dict()}
+
+def endFile():
+    # returns the record for the current file (None when disabled)
+    global current
+    record = current
+    current = None
+    if record is not None:
+        record['wall_time'] = time.perf_counter() - record.pop('start')
+    return record
+
+@contextlib.contextmanager
+def stage(name):
+    # adds the wall time of the block to the current file's stage
+    if current is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current['stages'][name] = current['stages'].get(name, 0.0) + time.perf_counter() - start
+
+def count(name, value=1):
+    if current is not None:
+        current['counts'][name] = current['counts'].get(name, 0) + value
+
+def summarize(records, wall_time=None):
+    # totals over the per-file records of a batch
+    stages = dict()
+    counts = dict()
+    for record in records:
+        for name, seconds in record['stages'].items():
+            stages[name] = stages.get(name, 0.0) + seconds
+        for name, value in record['counts'].items():
+            counts[name] = counts.get(name, 0) + value
+
+    return {'num_files': len(records), 'wall_time': wall_time, 'stages': stages, 'counts': counts, 'files': records}
+
+def writeSummary(summary_path, records, wall_time=None):
+    with open(summary_path, 'w') as summary_file:
+        json.dump(summarize(records, wall_time), summary_file, indent=2)
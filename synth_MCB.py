@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generates synthetic RACHuTS MCB profile TM frames for testing and benchmarking.
+
+    python3 synth_MCB.py out_file.dat num_packets [--bad-sync N] [--drop-bytes N] [--insert-bytes N] [--seed S]
+
+The frames have the 7-line XML header, the CRC line, and START + payload + CRC + END,
+where the payload is the 4-byte profile start time followed by 32-byte MCB packets
+that cycle through all six rotating TM enums.
+"""
+
+import argparse
+import binascii
+import numpy as np
+import MCB_TM
+
+# Default profile start (2021-10-01 00:00:00 UTC)
+PROFILE_START = 1633046400
+
+MCB_PACKET_DTYPE = MCB_TM.MCB_PACKET_DTYPE
+
+def synthPackets(num_packets, seed=0):
+    # realistic-looking raw packets, with the elapsed time wrapping like the 16-bit counter
+    rng = np.random.default_rng(seed)
+    packets = np.zeros(num_packets, dtype=MCB_PACKET_DTYPE)
+    itr = np.arange(num_packets)
+
+    packets['sync'] = 0xA5
+    packets['elapsed'] = (itr * 5) % 65536 # 0.5 s per packet
+    packets['enum'] = itr % 6
+
+    # rotating TM raw values for each enum: temps ~25 C, brake current, supply ~15 V
+    rot_base = np.array([30250, 30300, 30350, 30400, 100, 1960])[packets['enum']]
+    packets['rot_avg'] = rot_base + rng.integers(0, 20, num_packets)
+    packets['rot_max'] = packets['rot_avg'] + rng.integers(0, 20, num_packets)
+
+    for name in ('reel_torque', 'lw_torque'):
+        packets[name + '_avg'] = 30000 + rng.integers(-500, 500, num_packets)
+        packets[name + '_max'] = packets[name + '_avg'] + rng.integers(0, 100, num_packets)
+    for name in ('reel_curr', 'lw_curr'):
+        packets[name + '_avg'] = rng.integers(0, 3000, num_packets)
+        packets[name + '_max'] = np.minimum(packets[name + '_avg'] + rng.integers(0, 500, num_packets), MCB_TM.MAX_ADC_READ)
+
+    packets['reel_pos'] = np.cumsum(rng.normal(0.1, 0.05, num_packets), dtype=np.float32)
+    packets['lw_pos'] = 50 + 50 * np.sin(itr / 200.0)
+
+    return packets
+
+def synthPayload(num_packets, bad_sync=0, drop_bytes=0, seed=0, profile_start=PROFILE_START, insert_bytes=0):
+    # MCB payload: start time and packets, with optional bad sync bytes, dropped bytes and extra bytes
+    rng = np.random.default_rng(seed + 1)
+    packets = synthPackets(num_packets, seed)
+
+    if bad_sync:
+        corrupt = rng.choice(num_packets, size=min(bad_sync, num_packets), replace=False)
+        packets['sync'][corrupt] = rng.integers(0, 0xA5, len(corrupt))
+
+    payload = np.uint32(profile_start).byteswap().tobytes() + packets.tobytes()
+
+    if drop_bytes:
+        keep = np.ones(len(payload), dtype=bool)
+        keep[4 + rng.choice(len(payload) - 4, size=drop_bytes, replace=False)] = False
+        payload = np.frombuffer(payload, dtype=np.uint8)[keep].tobytes()
+
+    if insert_bytes:
+        positions = np.sort(4 + rng.choice(len(payload) - 4, size=insert_bytes, replace=False))
+        payload = np.insert(np.frombuffer(payload, dtype=np.uint8), positions,
+                            rng.integers(0, 256, insert_bytes).astype(np.uint8)).tobytes()
+
+    return payload
+
+def synthFrame(payload, message='MCB: Finished profile', msg_number=1):
+    # full TM frame around an MCB payload
+    header = ('<TM>\n'
+              '<Msg>' + str(msg_number) + '</Msg>\n'
+              '<Inst>RACHUTS</Inst>\n'
+              '<Length>' + str(len(payload)) + '</Length>\n'
+              '<StateFlag1>FINE</StateFlag1>\n'
+              '<StateMess1>' + message + '</StateMess1>\n'
+              '</TM>\n')
+    crc = binascii.crc_hqx(payload, 0)
+    return (header + '<CRC>' + str(crc) + '</CRC>\n').encode() + b'START' + payload + crc.to_bytes(2, 'big') + b'END'
+
+def writeSynthFile(file_path, num_packets, bad_sync=0, drop_bytes=0, seed=0, message='MCB: Finished profile',
+                   insert_bytes=0):
+    with open(file_path, 'wb') as TM_file:
+        TM_file.write(synthFrame(synthPayload(num_packets, bad_sync, drop_bytes, seed, insert_bytes=insert_bytes), message))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a synthetic RACHuTS MCB profile TM frame')
+    parser.add_argument('file', help='output .dat file')
+    parser.add_argument('packets', type=int, help='number of MCB packets')
+    parser.add_argument('--bad-sync', type=int, default=0, help='number of packets with a corrupt sync byte')
+    parser.add_argument('--drop-bytes', type=int, default=0, help='number of payload bytes to drop at random')
+    parser.add_argument('--insert-bytes', type=int, default=0, help='number of random bytes to insert in the payload')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--message', default='MCB: Finished profile', help='StateMess1 of the frame')
+    args = parser.parse_args()
+
+    writeSynthFile(args.file, args.packets, args.bad_sync, args.drop_bytes, args.seed, args.message, args.insert_bytes)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks the vectorized MCB decoder and CSV writer in MCB_TM.py against the original
+per-packet struct loop, on synthetic profiles from synth_MCB.py
+
+    python3 -m pytest test_MCB_TM.py
+"""
+
+import csv
+import os
+import struct
+from datetime import datetime
+import numpy as np
+import pytest
+import MCB_TM
+import synth_MCB
+
+CSV_HEADER = ['Elapsed Time', 'Reel Torque Avg', 'Reel Torque Max', 'LW Torque Avg', 'LW Torque Max', 'Reel Curr Avg',
+              'Reel Curr Max', 'LW Curr Avg', 'LW Curr Max', 'Differential Reel Speed', 'Reel Position',
+              'LW Position', 'Enum', 'Reel Temp Avg', 'Reel Temp Max', 'LW Temp Avg', 'LW Temp Max', 'MC1 Temp Avg',
+              'MC1 Temp Max', 'MC2 Temp Avg', 'MC2 Temp Max', 'Brake Curr Avg', 'Brake Curr Max', 'Supply Volt Avg',
+              'Supply Volt Max']
+
+def referenceMCBcsv(csv_name, data):
+    # the original one-packet-at-a-time decoder, kept as the reference for the CSV output
+    # (with newline='', as writeMCBcsv now opens the CSV, so the rows end in '\r\n' on every platform)
+    data_length = len(data)
+    num_packets = int((data_length - 4) / 32)
+    profile_start = struct.unpack_from('>I',data,0)[0]
+
+    with open(csv_name, mode='w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csv_writer.writerow(['Start time (s)', profile_start])
+        csv_writer.writerow(['Start time (UTC)', datetime.fromtimestamp(profile_start).strftime('%Y-%m-%d %H:%M:%S')])
+        csv_writer.writerow(CSV_HEADER)
+
+        # parse all of the packets
+        packet_start_index = 4
+        for itr in range(num_packets):
+            packet_data = ['-']*25
+
+            packet = struct.unpack_from('>BHBHHHHHHHHHHff',data,packet_start_index+itr*32)
+
+            # make sure the sync byte is valid
+            if packet[0] != 0xA5:
+                continue # skip to next packet
+
+            # get the regular TM
+            packet_data[0] = packet[1]/10.0 # ellapsed time
+            packet_data[1] =  0 if (0 == packet[5]) else(packet[5] - 30000)/10.0 # reel torque avg
+            packet_data[2] =  0 if (0 == packet[6]) else(packet[6] - 30000)/10.0 # reel torque max
+            packet_data[3] =  0 if (0 == packet[7]) else(packet[7] - 30000)/10.0 # lw torque avg
+            packet_data[4] =  0 if (0 == packet[8]) else(packet[8] - 30000)/10.0 # lw torque max
+            packet_data[5] = MCB_TM.SENSE_CURR_SLOPE * ((MCB_TM.VREF/MCB_TM.PULLDOWN_RESISTOR) * (packet[9]/MCB_TM.MAX_ADC_READ) - MCB_TM.I_OFFSET) # reel curr avg
+            packet_data[6] = MCB_TM.SENSE_CURR_SLOPE * ((MCB_TM.VREF/MCB_TM.PULLDOWN_RESISTOR) * (packet[10]/MCB_TM.MAX_ADC_READ) - MCB_TM.I_OFFSET) # reel curr max
+            packet_data[7] = MCB_TM.SENSE_CURR_SLOPE * ((MCB_TM.VREF/MCB_TM.PULLDOWN_RESISTOR) * (packet[11]/MCB_TM.MAX_ADC_READ) - MCB_TM.I_OFFSET) # lw curr avg
+            packet_data[8] = MCB_TM.SENSE_CURR_SLOPE * ((MCB_TM.VREF/MCB_TM.PULLDOWN_RESISTOR) * (packet[12]/MCB_TM.MAX_ADC_READ) - MCB_TM.I_OFFSET) # lw curr max
+            if (itr > 0):
+                packet_data[9] = (packet[13] - last_reel_pos) / (packet_data[0] - last_time) * 60
+            packet_data[10] = packet[13] # reel position
+            packet_data[11] = packet[14] # lw position
+
+            # update tracking variables
+            last_reel_pos = packet[13]
+            last_time = packet_data[0]
+
+            # get the rotating TM
+            packet_data[12] = packet[2]
+            if (0 == packet[2]): # reel temp
+                packet_data[13] = 0 if (0 == packet[3]) else (packet[3] - 30000)/10.0
+                packet_data[14] = 0 if (0 == packet[4]) else (packet[4] - 30000)/10.0
+            elif (1 == packet[2]): # lw temp
+                packet_data[15] = 0 if (0 == packet[3]) else (packet[3] - 30000)/10.0
+                packet_data[16] = 0 if (0 == packet[4]) else (packet[4] - 30000)/10.0
+            elif (2 == packet[2]): # mc1 temp
+                packet_data[17] = 0 if (0 == packet[3]) else (packet[3] - 30000)/10.0
+                packet_data[18] = 0 if (0 == packet[4]) else (packet[4] - 30000)/10.0
+            elif (3 == packet[2]): # mc2 temp
+                packet_data[19] = 0 if (0 == packet[3]) else (packet[3] - 30000)/10.0
+                packet_data[20] = 0 if (0 == packet[4]) else (packet[4] - 30000)/10.0
+            elif (4 == packet[2]): # brake curr
+                packet_data[21] = packet[3]
+                packet_data[22] = packet[4]
+            elif (5 == packet[2]): # supply voltage
+                packet_data[23] = MCB_TM.VREF * (packet[3]/MCB_TM.MAX_ADC_READ) / MCB_TM.SUPPLY_VOLT_DIV
+                packet_data[24] = MCB_TM.VREF * (packet[4]/MCB_TM.MAX_ADC_READ) / MCB_TM.SUPPLY_VOLT_DIV
+
+            csv_writer.writerow(packet_data)
+
+def profilePayload(num_packets, bad_sync=(), seed=0):
+    # synth_MCB packets with the sync byte corrupted at the given packets (the reference
+    # loop needs packet 0 intact for the differential speed)
+    packets = synth_MCB.synthPackets(num_packets, seed)
+    packets['sync'][list(bad_sync)] = 0x5A
+    return np.uint32(synth_MCB.PROFILE_START).byteswap().tobytes() + packets.tobytes()
+
+def compareCSV(tmp_path, payload):
+    os.makedirs(str(tmp_path / MCB_TM.RESULTS_DIR))
+    MCB_TM.parseMCBData('TM_1.dat', str(tmp_path), payload)
+    referenceMCBcsv(str(tmp_path / 'reference.csv'), payload)
+
+    with open(str(tmp_path / MCB_TM.RESULTS_DIR / 'TM_1.csv'), 'rb') as csv_file:
+        decoded = csv_file.read()
+    with open(str(tmp_path / 'reference.csv'), 'rb') as csv_file:
+        reference = csv_file.read()
+
+    assert decoded.splitlines()[:3] == reference.splitlines()[:3]
+    assert decoded == reference
+
+def test_clean_profile(tmp_path):
+    compareCSV(tmp_path, profilePayload(3000))
+
+@pytest.mark.parametrize('bad_sync', [(1,), (17, 18, 19), (5, 600, 2999)])
+def test_bad_sync_profile(tmp_path, bad_sync):
+    compareCSV(tmp_path, profilePayload(3000, bad_sync, seed=len(bad_sync)))
+
+def test_counter_wrap_profile(tmp_path):
+    # 0.5 s per packet, so the 16-bit elapsed time counter wraps after 13108 packets
+    compareCSV(tmp_path, profilePayload(30000, (13107, 20000), seed=3))
+
+def test_rotating_zero_values(tmp_path):
+    # raw 0 reads are written as an integer 0 in the temperature and torque columns
+    packets = synth_MCB.synthPackets(600)
+    packets['rot_avg'][::7] = 0
+    packets['reel_torque_max'][::11] = 0
+    packets['lw_torque_avg'][::13] = 0
+    compareCSV(tmp_path, np.uint32(synth_MCB.PROFILE_START).byteswap().tobytes() + packets.tobytes())
+
+def test_load_csv_line_endings(tmp_path):
+    # CSVs written on Windows before the rows were written with newline='' end in '\r\r\n'
+    packets = synth_MCB.synthPackets(300)
+    os.makedirs(str(tmp_path / MCB_TM.RESULTS_DIR))
+    MCB_TM.parseMCBData('TM_1.dat', str(tmp_path), np.uint32(synth_MCB.PROFILE_START).byteswap().tobytes() + packets.tobytes())
+    csv_name = str(tmp_path / MCB_TM.RESULTS_DIR / 'TM_1.csv')
+    profile_start, columns = MCB_TM.loadMCBcsv(csv_name)
+
+    with open(csv_name, 'rb') as csv_file:
+        text = csv_file.read()
+    for line_end in (b'\n', b'\r\r\n'):
+        with open(str(tmp_path / 'endings.csv'), 'wb') as csv_file:
+            csv_file.write(text.replace(b'\r\n', line_end))
+        loaded_start, loaded = MCB_TM.loadMCBcsv(str(tmp_path / 'endings.csv'))
+
+        assert loaded_start == profile_start
+        assert sorted(loaded) == sorted(columns)
+        for name in columns:
+            np.testing.assert_array_equal(loaded[name], columns[name])
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks the parallel CCMz mirroring in retrieve_st2_data.py against a local stand-in
+for the CCMz SFTP server, whose connections, listings and file opens sleep like a remote link
+
+    python3 -m pytest test_retrieve_st2_data.py
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+import pytest
+
+pytest.importorskip('pysftp')
+import retrieve_st2_data
+
+CCMZ_FOLDER = 'ST2_C0_03_TTL3/RACHUTS/Flight/TM/Processed'
+
+class FakeAttributes(object):
+    """
+    The SFTPAttributes fields used by mirror_ccmz_folder.
+    """
+
+    def __init__(self, filename, file_stat):
+        self.filename = filename
+        self.longname = '-rw-r--r-- 1 ccmz ccmz ' + str(file_stat.st_size) + ' ' + filename
+        self.st_size = file_stat.st_size
+        self.st_mtime = int(file_stat.st_mtime)
+
+
+class TransferLog(object):
+    """
+    Shared by the connections of a pool: the opens of each file, and the transfers in progress
+    (from the request to open a file until it is closed) with their peak.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opened = dict()
+        self.active = 0
+        self.peak = 0
+
+    def begin(self, filename):
+        with self.lock:
+            self.opened[filename] = self.opened.get(filename, 0) + 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def end(self):
+        with self.lock:
+            self.active -= 1
+
+
+class FakeRemoteFile(object):
+    """
+    Remote file served from a local file (the latency is taken when it is opened).
+    """
+
+    def __init__(self, path, log):
+        self.local_file = open(path, 'rb')
+        self.log = log
+
+    def prefetch(self, file_size=None):
+        pass
+
+    def read(self, size=-1):
+        return self.local_file.read(size)
+
+    def close(self):
+        self.local_file.close()
+        self.log.end()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FakeSFTP(object):
+    """
+    Stand-in for a pysftp.Connection to the CCMz, serving the files under remote_root.
+    Connecting, listing and opening a file each sleep for latency seconds.
+    failures maps a file name to the number of times opening it fails (-1 for always);
+    it and the TransferLog log are shared by the connections of a pool.
+    """
+
+    def __init__(self, remote_root, latency=0.02, failures=None, log=None):
+        self.remote_root = remote_root
+        self.latency = latency
+        self.failures = failures if failures is not None else dict()
+        self.log = log if log is not None else TransferLog()
+        time.sleep(latency)
+
+    def listdir_attr(self, remote_path='.'):
+        time.sleep(self.latency)
+        folder = os.path.join(self.remote_root, remote_path)
+        if not os.path.isdir(folder):
+            raise IOError('No such file: ' + remote_path)
+        return [FakeAttributes(filename, os.stat(os.path.join(folder, filename))) for filename in sorted(os.listdir(folder))]
+
+    def open(self, remote_file, mode='r'):
+        filename = os.path.basename(remote_file)
+        self.log.begin(filename)
+        time.sleep(self.latency)
+        with self.log.lock:
+            failed = self.failures.get(filename, 0) != 0
+            if failed:
+                self.failures[filename] -= 1
+        if failed:
+            self.log.end()
+            raise IOError('Connection lost while opening ' + filename)
+        return FakeRemoteFile(os.path.join(self.remote_root, remote_file), self.log)
+
+    def close(self):
+        pass
+
+
+def frame_contents(itr):
+    return b'<TM>\n<Msg>' + str(itr).encode() + b'</Msg>\n</TM>\n' + bytes(range(256)) * 8
+
+def make_remote_folder(remote_root, num_files):
+    # gzipped TM frames named like the CCMz ones (date, time, number), over two days
+    folder = os.path.join(str(remote_root), CCMZ_FOLDER)
+    os.makedirs(folder)
+    filenames = []
+    for itr in range(num_files):
+        filename = 'ST2_C0_03_TTL3_RACHUTS_2021100' + str(1 + itr % 2) + '_1200_' + str(itr).zfill(4) + '_TM.gz'
+        with gzip.open(os.path.join(folder, filename), 'wb') as gz_file:
+            gz_file.write(frame_contents(itr))
+        filenames.append(filename)
+    return filenames
+
+def local_frame_path(local_root, filename):
+    filedate = filename.rsplit('_', 4)[1]
+    return os.path.join(str(local_root), 'FullTM_' + filedate[4:6] + '-' + filedate[6:8] + '-' + filedate[2:4], filename[:-3])
+
+def mirror(remote_root, local_root, n_workers, failures=None, log=None, latency=0.02, on_new_frame=None,
+           stop_event=None):
+    new_frames = []
+    def new_frame(datafilepath):
+        new_frames.append(datafilepath)
+        if on_new_frame is not None:
+            on_new_frame(datafilepath)
+    pool = retrieve_st2_data.CCMzConnectionPool(lambda: FakeSFTP(str(remote_root), latency, failures, log))
+    try:
+        retrieve_st2_data.mirror_ccmz_folder(CCMZ_FOLDER, str(local_root), show_individual_file=False, pool=pool,
+                                             n_workers=n_workers, on_new_frame=new_frame, stop_event=stop_event)
+    finally:
+        pool.close()
+    return new_frames
+
+def load_manifest(local_root):
+    with open(os.path.join(str(local_root), CCMZ_FOLDER, retrieve_st2_data.manifest_filename)) as manifest_file:
+        return json.load(manifest_file)
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(retrieve_st2_data, 'download_retry_delay', 0)
+
+def test_parallel_downloads(tmp_path):
+    filenames = make_remote_folder(tmp_path / 'ccmz', 24)
+
+    serial_log = TransferLog()
+    mirror(tmp_path / 'ccmz', tmp_path / 'serial', 1, log=serial_log)
+    assert 1 == serial_log.peak
+
+    # the transfers overlap, up to one per worker
+    log = TransferLog()
+    new_frames = mirror(tmp_path / 'ccmz', tmp_path / 'parallel', 8, log=log, latency=0.05)
+    assert 2 <= log.peak <= 8
+    assert 0 == log.active
+    assert sorted(new_frames) == sorted(local_frame_path(tmp_path / 'parallel', filename) for filename in filenames)
+    assert sorted(os.listdir(str(tmp_path / 'parallel'))) == ['FullTM_10-01-21', 'FullTM_10-02-21', 'ST2_C0_03_TTL3']
+    for itr, filename in enumerate(filenames):
+        with open(local_frame_path(tmp_path / 'parallel', filename), 'rb') as frame_file:
+            assert frame_file.read() == frame_contents(itr)
+    assert sorted(load_manifest(tmp_path / 'parallel')) == sorted(filenames)
+
+    # nothing changed on the CCMz, so nothing is downloaded again
+    assert mirror(tmp_path / 'ccmz', tmp_path / 'parallel', 8) == []
+
+def test_retried_download(tmp_path):
+    filenames = make_remote_folder(tmp_path / 'ccmz', 6)
+    failures = {filenames[2]: retrieve_st2_data.n_download_retries - 1}
+    log = TransferLog()
+
+    new_frames = mirror(tmp_path / 'ccmz', tmp_path / 'local', 3, failures, log)
+
+    assert len(new_frames) == len(filenames)
+    assert log.opened[filenames[2]] == retrieve_st2_data.n_download_retries
+    assert log.opened[filenames[0]] == 1
+    with open(local_frame_path(tmp_path / 'local', filenames[2]), 'rb') as frame_file:
+        assert frame_file.read() == frame_contents(2)
+
+def test_failing_file_does_not_abort_folder(tmp_path):
+    filenames = make_remote_folder(tmp_path / 'ccmz', 8)
+    failures = {filenames[3]: -1}
+    log = TransferLog()
+
+    new_frames = mirror(tmp_path / 'ccmz', tmp_path / 'local', 4, failures, log)
+
+    assert log.opened[filenames[3]] == retrieve_st2_data.n_download_retries
+    assert sorted(new_frames) == sorted(local_frame_path(tmp_path / 'local', filename)
+                                        for filename in filenames if filename != filenames[3])
+    assert not os.path.exists(local_frame_path(tmp_path / 'local', filenames[3]))
+    assert filenames[3] not in load_manifest(tmp_path / 'local')
+    for dirpath, dirnames, local_files in os.walk(str(tmp_path / 'local')):
+        assert not [local_file for local_file in local_files if local_file.endswith('.part')]
+
+    # once the CCMz serves it again, only the failed file is downloaded
+    failures.clear()
+    assert mirror(tmp_path / 'ccmz', tmp_path / 'local', 4) == [local_frame_path(tmp_path / 'local', filenames[3])]
+
+def test_stop_keeps_downloaded_files(tmp_path):
+    filenames = make_remote_folder(tmp_path / 'ccmz', 12)
+    stop_event = threading.Event()
+
+    # stopped after the first file, the downloads already started are finished
+    new_frames = mirror(tmp_path / 'ccmz', tmp_path / 'local', 2, on_new_frame=lambda datafilepath: stop_event.set(),
+                        stop_event=stop_event)
+
+    assert 1 <= len(new_frames) <= 3
+    assert len(load_manifest(tmp_path / 'local')) == len(new_frames)
+
+    # the next sync fetches only the files left over
+    assert len(mirror(tmp_path / 'ccmz', tmp_path / 'local', 4)) == len(filenames) - len(new_frames)
+
+def test_frames_keep_ccmz_mtime(tmp_path):
+    # a frame downloaded again (e.g. after a lost manifest) keeps the stamp its processing was ledgered with
+    filenames = make_remote_folder(tmp_path / 'ccmz', 2)
+    remote_mtime = int(os.stat(os.path.join(str(tmp_path / 'ccmz'), CCMZ_FOLDER, filenames[0])).st_mtime)
+
+    mirror(tmp_path / 'ccmz', tmp_path / 'local', 2)
+    frame_path = local_frame_path(tmp_path / 'local', filenames[0])
+    frame_stat = os.stat(frame_path)
+    assert int(frame_stat.st_mtime) == remote_mtime
+
+    os.remove(os.path.join(str(tmp_path / 'local'), CCMZ_FOLDER, retrieve_st2_data.manifest_filename))
+    time.sleep(0.01)
+    mirror(tmp_path / 'ccmz', tmp_path / 'local', 2)
+    assert (os.stat(frame_path).st_size, os.stat(frame_path).st_mtime_ns) == (frame_stat.st_size, frame_stat.st_mtime_ns)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks that st2tm.decodeMCB recovers the intact packets of corrupted synth_MCB payloads
+(bad sync bytes, dropped bytes, extra bytes, and both at once) and only those
+
+    python3 -m pytest test_st2tm_mcb.py
+"""
+
+import numpy as np
+import pytest
+import st2tm
+import synth_MCB
+
+NUM_PACKETS = 500
+
+def profilePackets(seed=0):
+    return synth_MCB.synthPackets(NUM_PACKETS, seed)
+
+def packetBytes(packets):
+    return [packets[itr:itr+1].tobytes() for itr in range(len(packets))]
+
+def payloadBytes(packets, drops=(), inserts=()):
+    # drops are offsets into the packets, inserts (offset, value) pairs, both before any change
+    body = bytearray(packets.tobytes())
+    edits = [(offset, None) for offset in drops] + list(inserts)
+    for offset, value in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        if value is None:
+            del body[offset]
+        else:
+            body.insert(offset, value)
+    return np.uint32(synth_MCB.PROFILE_START).byteswap().tobytes() + bytes(body)
+
+def assertGenuine(profile, packets):
+    # every decoded packet is one of the packets that were sent, in order
+    sent = packetBytes(packets)
+    decoded = packetBytes(profile.packets)
+    indices = [sent.index(packet) for packet in decoded if packet in sent]
+    assert len(indices) == len(decoded)
+    assert indices == sorted(indices)
+    return indices
+
+def test_clean_payload():
+    packets = profilePackets()
+    profile = st2tm.decodeMCB(payloadBytes(packets))
+
+    assert profile.gaps is None
+    assert 0 == len(profile.bad_sync)
+    assert assertGenuine(profile, packets) == list(range(NUM_PACKETS))
+
+def test_bad_sync_bytes():
+    packets = profilePackets()
+    packets['sync'][[0, 17, 18, 250, 499]] = 0x5A
+    profile = st2tm.decodeMCB(payloadBytes(packets))
+
+    assert profile.bad_sync.tolist() == [0, 17, 18, 250, 499]
+    assert assertGenuine(profile, packets) == [itr for itr in range(NUM_PACKETS) if itr not in (0, 17, 18, 250, 499)]
+
+def test_dropped_byte():
+    packets = profilePackets()
+    profile = st2tm.decodeMCB(payloadBytes(packets, drops=[50 * 32 + 9]))
+
+    assert assertGenuine(profile, packets) == [itr for itr in range(NUM_PACKETS) if itr != 50]
+    assert profile.gaps == [(4 + 50 * 32, 31)]
+
+def test_inserted_byte():
+    # the packet with the extra byte is skipped whole, not cut to 32 bytes
+    packets = profilePackets()
+    profile = st2tm.decodeMCB(payloadBytes(packets, inserts=[(50 * 32 + 9, 0x11)]))
+
+    assert assertGenuine(profile, packets) == [itr for itr in range(NUM_PACKETS) if itr != 50]
+    assert profile.gaps == [(4 + 50 * 32, 33)]
+
+def test_inserted_sync_byte():
+    # an extra byte that reads as a sync byte does not start a packet
+    packets = profilePackets()
+    profile = st2tm.decodeMCB(payloadBytes(packets, inserts=[(50 * 32 + 16, 0xA5), (50 * 32 + 18, 0x02)]))
+
+    assert assertGenuine(profile, packets) == [itr for itr in range(NUM_PACKETS) if itr != 50]
+
+def test_dropped_and_inserted_bytes():
+    # the payload length is unchanged, but the packets between the two are off the 32-byte grid
+    packets = profilePackets()
+    profile = st2tm.decodeMCB(payloadBytes(packets, drops=[100 * 32 + 5], inserts=[(400 * 32 + 20, 0x33)]))
+
+    assert 0 == (profile.data_length - 4) % 32
+    assert assertGenuine(profile, packets) == [itr for itr in range(NUM_PACKETS) if itr not in (100, 400)]
+    assert profile.gaps == [(4 + 100 * 32, 31), (4 + 399 * 32 + 31, 33)]
+
+def test_payload_start_and_end():
+    # a missing enum byte in the first packet, a short last packet
+    packets = profilePackets()
+    profile = st2tm.decodeMCB(payloadBytes(packets, drops=[3, (NUM_PACKETS - 1) * 32 + 20]))
+
+    assert assertGenuine(profile, packets) == list(range(1, NUM_PACKETS - 1))
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('drop_bytes, insert_bytes', [(2, 0), (0, 2), (2, 2), (1, 3)])
+def test_random_corruption(seed, drop_bytes, insert_bytes):
+    # only the packets hit by a dropped or extra byte, or next to one, may be lost
+    packets = profilePackets(seed)
+    payload = synth_MCB.synthPayload(NUM_PACKETS, drop_bytes=drop_bytes, seed=seed, insert_bytes=insert_bytes)
+    profile = st2tm.decodeMCB(payload)
+
+    indices = assertGenuine(profile, packets)
+    assert len(indices) >= NUM_PACKETS - 2 * (drop_bytes + insert_bytes)